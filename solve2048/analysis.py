@@ -0,0 +1,271 @@
+import concurrent.futures
+import csv
+import itertools
+import json
+import logging
+import time
+from typing import (Any, Callable, Dict, IO, Iterable, Iterator, List,
+                    Tuple)
+
+import rules
+import transposition
+import utils
+
+_log = logging.getLogger()
+
+Rows = List[List[int]]
+
+#: Transformation of the board and the mapping of the directions in the
+#: original board to the directions in the transformed board.
+Symmetry = Tuple[Callable[[Rows], Rows],
+                 Dict[rules.Direction, rules.Direction]]
+
+
+def analyze_board(rows: Rows, depth: int, score: int) -> Dict[str, Any]:
+    """Searches for the best direction on the board.
+
+    :param rows: Tiles of the board row by row, 0 for empty tiles.
+    :param depth: Number of steps to look forward.
+    :param score: Max score when the game ends.
+    :returns: Name of the best direction (None if there is no applicable
+        direction) and the utilities of the applicable directions.
+    """
+
+    import search
+
+    game_ = rules.Game2048.from_rows(rows, terminal_score=score)
+    try:
+        action, utilities = search.expectimax_analysis(
+            game_,
+            depth=depth,
+            alpha=game_.min_utility(),
+            beta=game_.max_utility())
+    except StopIteration:
+        return dict(direction=None, utilities={})
+
+    finally:
+        if transposition.table is not None:
+            transposition.table.publish_stats()
+
+    return dict(direction=action['direction'].name,
+                utilities={a['direction'].name: v for a, v in utilities})
+
+
+def analyze_stream(boards: Iterable[Any],
+                   size: rules.Size,
+                   depth: int,
+                   score: int,
+                   workers: int,
+                   batch_size: int = 256,
+                   symmetric: bool = False,
+                   seed: int = 0,
+                   cache_size: int = None,
+                   table: transposition.SharedTable = None
+                   ) -> Iterator[Dict[str, Any]]:
+    """Analyzes the boards in a pool of processes.
+
+    Boards are consumed in batches of `batch_size`, so that memory stays
+    bounded regardless of the length of the input. Identical boards within a
+    batch are searched only once.
+
+    :param boards: Boards row by row, or exceptions describing unparsable
+        input lines.
+    :param size: Size of the boards.
+    :param depth: Number of steps to look forward.
+    :param score: Max score when the game ends.
+    :param workers: Number of worker processes.
+    :param batch_size: Number of boards to read ahead.
+    :param symmetric: Also deduplicate boards which are rotations or
+        reflections of each other. The heuristic prefers the (top, left)
+        corner, so this trades exactness for fewer searches.
+    :param seed: Random seed of the workers.
+    :param cache_size: Cache size of the workers. (Actual cache size is
+        2 ** cache_size)
+    :param table: Transposition table shared by the workers.
+    :returns: Results in the input order.
+    """
+
+    symmetries_ = symmetries(size) if symmetric else symmetries(size)[:1]
+    stats = AnalysisStats()
+
+    initargs = (seed, cache_size, (table.name, table.lock) if table else None)
+    with concurrent.futures.ProcessPoolExecutor(
+            workers,
+            initializer=utils.init_worker,
+            initargs=initargs) as executor:
+        it = iter(boards)
+        while True:
+            batch = list(itertools.islice(it, batch_size))
+            if not batch:
+                break
+
+            # Map each board to its canonical form, and search each canonical
+            # form only once.
+
+            keys = []
+            unique = {}
+            for rows in batch:
+                try:
+                    if isinstance(rows, Exception):
+                        raise rows
+                    game_ = rules.Game2048.from_rows(rows,
+                                                     terminal_score=score,
+                                                     size=size)
+                except ValueError as e:
+                    keys.append(e)
+                    continue
+
+                rows_, symmetry = canonical(game_.to_rows(), symmetries_)
+                key = tuple(tuple(row) for row in rows_)
+                keys.append((key, symmetry))
+                unique.setdefault(key, rows_)
+
+            futures = {k: executor.submit(analyze_board, v, depth, score)
+                       for k, v in unique.items()}
+
+            for rows, k in zip(batch, keys):
+                if isinstance(k, Exception):
+                    stats.failed += 1
+                    yield dict(index=stats.boards, error=str(k))
+                else:
+                    key, (_, mapping) = k
+                    rv = _restore(futures[key].result(), mapping)
+                    yield dict(index=stats.boards, board=rows, **rv)
+                stats.boards += 1
+
+            stats.searched += len(unique)
+            _log.info(stats)
+
+    _log.warning(stats)
+    if table:
+        _log.warning(table.get_stats())
+
+
+class AnalysisStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.boards = 0
+        self.searched = 0
+        self.failed = 0
+
+    def throughput(self) -> float:
+        """:returns: Boards per second."""
+
+        return self.boards / ((time.perf_counter() - self.start) or 0.001)
+
+    def __str__(self):
+        valid = self.boards - self.failed
+        return (f"Boards: {self.boards}. "
+                f"Searched: {self.searched}. "
+                f"Deduplicated: {valid - self.searched}. "
+                f"Failed: {self.failed}. "
+                f"Throughput: {self.throughput():.2f} boards/s")
+
+
+# Input / Output
+# -----------------------------------------------------------------------------
+
+def read_jsonl(f: IO[str]) -> Iterator[Any]:
+    """Reads one board per line, either as a list of rows, or as an object
+    with the rows under `board` key."""
+
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            rv = json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+            continue
+        if isinstance(rv, dict):
+            rv = rv.get('board')
+        yield rv
+
+
+def read_csv(f: IO[str], size: rules.Size) -> Iterator[Any]:
+    """Reads one board per line, with the tiles in row-major order. Empty
+    values stand for empty tiles."""
+
+    height, width = size
+    for values in csv.reader(f):
+        if not values:
+            continue
+        if len(values) != height * width:
+            yield ValueError(f"Expected {height * width} tiles, "
+                             f"got {len(values)}.")
+            continue
+        try:
+            values = [int(x) if x.strip() else 0 for x in values]
+        except ValueError as e:
+            yield e
+            continue
+        yield [values[i * width:(i + 1) * width] for i in range(height)]
+
+
+def write_jsonl(results: Iterable[Dict[str, Any]], f: IO[str]) -> None:
+    for r in results:
+        f.write(json.dumps(r))
+        f.write("\n")
+
+
+# Symmetries
+# -----------------------------------------------------------------------------
+
+def symmetries(size: rules.Size) -> List[Symmetry]:
+    """:returns: Symmetries of the board, identity first."""
+
+    up, right, down, left = (rules.Direction.UP,
+                             rules.Direction.RIGHT,
+                             rules.Direction.DOWN,
+                             rules.Direction.LEFT)
+
+    rv = [
+        (lambda r: r,
+         {up: up, right: right, down: down, left: left}),
+        (lambda r: [row[::-1] for row in r],
+         {up: up, right: left, down: down, left: right}),
+        (lambda r: r[::-1],
+         {up: down, right: right, down: up, left: left}),
+        (lambda r: [row[::-1] for row in r[::-1]],
+         {up: down, right: left, down: up, left: right}),
+    ]
+
+    height, width = size
+    if height == width:
+        transpose = {up: left, right: down, down: right, left: up}
+        for f, mapping in list(rv):
+            rv.append((
+                lambda r, f=f: f([list(x) for x in zip(*r)]),
+                {d: mapping[transpose[d]] for d in rules.Direction}))
+
+    return rv
+
+
+def canonical(rows: Rows,
+              symmetries_: List[Symmetry]) -> Tuple[Rows, Symmetry]:
+    """:returns: Smallest of the transformed boards and the transformation."""
+
+    rv = None
+    for symmetry in symmetries_:
+        f, _ = symmetry
+        transformed = f(rows)
+        if rv is None or transformed < rv[0]:
+            rv = transformed, symmetry
+    return rv
+
+
+def _restore(result: Dict[str, Any],
+             mapping: Dict[rules.Direction, rules.Direction]
+             ) -> Dict[str, Any]:
+    """Maps the directions from the canonical board back to the original
+    board."""
+
+    utilities = result['utilities']
+    direction = result['direction']
+    if direction is not None:
+        direction = next(d.name for d, v in mapping.items()
+                         if v.name == direction)
+    return dict(
+        direction=direction,
+        utilities={d.name: utilities[v.name] for d, v in mapping.items()
+                   if v.name in utilities})
@@ -0,0 +1,202 @@
+import collections
+import concurrent.futures
+import logging
+import mmap
+import struct
+from typing import List, Optional, Tuple
+
+import analysis
+import retrograde
+import rules
+import utils
+
+_log = logging.getLogger()
+
+#: File starts with the magic, followed by the header (version, height,
+#: width, exponent of the terminal score, search depth and number of
+#: positions), the sorted keys of the positions and their best directions.
+#:
+#: Positions are keyed as by `retrograde.pack`, and only for MAX to move.
+#: They are stored as they appear, not folded by symmetry: `utility` is
+#: anchored to the top left corner, so the best direction of a reflected
+#: board is often not the reflected direction.
+MAGIC = b'S2048BK\0'
+VERSION = 2
+
+_HEADER = struct.Struct('<BBBBIQ')
+_KEY = struct.Struct('<Q')
+
+_DIRECTIONS = list(rules.Direction)
+
+
+class Book:
+    """Best directions of frequent positions, looked up in a file built by
+    `build`."""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        m = self._mmap
+        if m[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a policy book.')
+        version, height, width, exponent, depth, count = \
+            _HEADER.unpack_from(m, len(MAGIC))
+        if version != VERSION:
+            raise ValueError(f'Unsupported policy book version: {version}.')
+
+        self.size = (height, width)
+        self.terminal_score = 2 ** exponent
+        self.depth = depth
+        self.count = count
+
+        self._keys = len(MAGIC) + _HEADER.size
+        self._directions = self._keys + count * _KEY.size
+        if len(m) != self._directions + count:
+            raise ValueError('Truncated policy book.')
+
+    def lookup(self, game_: rules.Game2048) -> Optional[rules.Direction]:
+        """:returns: Best direction, None if the position is not in the
+        book."""
+
+        if game_.size != self.size or \
+                game_.terminal_score != self.terminal_score:
+            raise ValueError('Game does not match the book.')
+        if game_.player != +1:
+            return None
+
+        i = self._index(_key(game_.to_rows()))
+        if i is None:
+            return None
+        return _DIRECTIONS[self._mmap[self._directions + i]]
+
+    def _index(self, key: int) -> Optional[int]:
+        m = self._mmap
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k, = _KEY.unpack_from(m, self._keys + mid * _KEY.size)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> 'Book':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def build(path: str,
+          size: rules.Size,
+          terminal_score: int,
+          depth: int,
+          games: int,
+          moves: int,
+          positions: int,
+          book_depth: int,
+          workers: int,
+          seed: int = 0,
+          cache_size: int = None) -> int:
+    """Plays self-play games, and writes the best directions of their most
+    frequent positions into a book.
+
+    :param path: Path of the file to write.
+    :param size: Size of the board.
+    :param terminal_score: Max score when the game ends. Must be a power of
+        two.
+    :param depth: Search depth of the self-play.
+    :param games: Number of self-play games, seeded from `seed`.
+    :param moves: Number of moves of each self-play game.
+    :param positions: Max number of positions in the book.
+    :param book_depth: Search depth of the positions in the book.
+    :param workers: Number of worker processes.
+    :param seed: Seed of the first self-play game.
+    :param cache_size: Cache size of the workers. (Actual cache size is
+        2 ** cache_size)
+    :returns: Number of positions in the book.
+    """
+
+    height, width = size
+    exponent = terminal_score.bit_length() - 1
+    if terminal_score != 2 ** exponent or exponent >= 16:
+        raise ValueError('Terminal score must be a power of two up to 2^15.')
+    if height * width > 16:
+        raise ValueError('Board must have at most 16 tiles.')
+
+    with concurrent.futures.ProcessPoolExecutor(
+            workers,
+            initializer=utils.init_worker,
+            initargs=(seed, cache_size)) as executor:
+
+        # Count the positions of the self-play games.
+
+        counts = collections.Counter()
+        for i, rv in enumerate(executor.map(
+                _self_play,
+                range(seed, seed + games),
+                [size] * games,
+                [terminal_score] * games,
+                [depth] * games,
+                [moves] * games)):
+            counts.update(rv)
+            _log.info(f"Game: {i}. Positions: {len(counts)}")
+
+        # Search the most frequent ones deeply.
+
+        frequent = [rows for rows, _ in counts.most_common(positions)]
+        directions = {}
+        for rows, rv in zip(frequent, executor.map(
+                analysis.analyze_board,
+                [[list(row) for row in rows] for rows in frequent],
+                [book_depth] * len(frequent),
+                [terminal_score] * len(frequent))):
+            if rv['direction'] is not None:
+                directions[_key(rows)] = \
+                    _DIRECTIONS.index(rules.Direction[rv['direction']])
+            _log.debug(f"Position: {rows}. Direction: {rv['direction']}")
+
+    keys = sorted(directions)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER.pack(VERSION, height, width, exponent, book_depth,
+                             len(keys)))
+        f.write(b''.join(_KEY.pack(k) for k in keys))
+        f.write(bytes(directions[k] for k in keys))
+
+    return len(keys)
+
+
+def _self_play(seed: int,
+               size: rules.Size,
+               terminal_score: int,
+               depth: int,
+               moves: int) -> List[Tuple[Tuple[int, ...], ...]]:
+    """:returns: Positions of MAX to move in one self-play game."""
+
+    import distributed
+
+    rv = []
+
+    def visit(game_):
+        if game_.actions():
+            rv.append(tuple(tuple(row) for row in game_.to_rows()))
+
+    distributed.play_game(seed, size, terminal_score, depth,
+                          visit=visit,
+                          max_moves=moves)
+    return rv
+
+
+def _key(rows: analysis.Rows) -> int:
+    return retrograde.pack(tuple((value or 1).bit_length() - 1
+                                 for row in rows
+                                 for value in row))
@@ -1,6 +1,11 @@
-from typing import Any, Callable, Iterator, List, Tuple
+import functools
+import itertools
+import random
+import sys
+from typing import Any, Callable, Iterator, List, Optional, Tuple
 
 import cachetools
+import cachetools.keys
 
 import utils
 
@@ -12,7 +17,7 @@ _caches = {}
 
 def cached(maxsize: int = None, key: Callable = None, group: Any = None):
     maxsize = maxsize or CACHE_MAXSIZE
-    key = key or _cachekey
+    key = key or cachekey
 
     def outer(func):
         if CACHE_ENABLED:
@@ -26,6 +31,7 @@ def cached(maxsize: int = None, key: Callable = None, group: Any = None):
                 name=name)
 
             @cachetools.cached(cache, key=key)
+            @functools.wraps(func)
             def inner(*args, **kwargs):
                 return func(*args, **kwargs)
 
@@ -43,6 +49,9 @@ class StatisticsCache(cachetools.RRCache):
                  module: str = None,
                  name: str = None,
                  **kwargs):
+        # Evict with a private generator, so that evictions do not change the
+        # game played with a given seed.
+        kwargs.setdefault('choice', random.Random(0).choice)
         super().__init__(*args, **kwargs)
         self.group = group
         self.module = module
@@ -60,9 +69,37 @@ class StatisticsCache(cachetools.RRCache):
             self.hit += 1
             return rv
 
+    def clear(self) -> None:
+        # RRCache.popitem picks a random key from a list of all keys, which
+        # makes the inherited clear() quadratic.
+        for k in list(self):
+            del self[k]
+
     def reset_stats(self) -> None:
         self.hit = self.miss = 0
 
+    def estimate_bytes(self, samples: int = 16) -> int:
+        """:returns: Estimated memory held by the entries, extrapolated from
+        the sizes of the first few."""
+
+        count = len(self)
+        if not count:
+            return 0
+        sample = list(itertools.islice(self.items(), samples))
+        size = sum(_sizeof(k) + _sizeof(v) for k, v in sample) / len(sample)
+        return int(count * (size + _ENTRY_OVERHEAD))
+
+    def drop(self, predicate: Callable[[Any], bool]) -> int:
+        """Deletes the entries whose key satisfies the predicate.
+
+        :returns: Number of deleted entries.
+        """
+
+        keys = [k for k in self if predicate(k)]
+        for k in keys:
+            del self[k]
+        return len(keys)
+
     def get_stats(self) -> List[str]:
         hit = self.hit
         miss = self.miss
@@ -88,6 +125,16 @@ def reset_stats(**filters) -> None:
         v.reset_stats()
 
 
+def clear(**filters) -> None:
+    for _, v in _iter_caches(**filters):
+        v.clear()
+
+
+def iter_caches(**filters) -> Iterator[StatisticsCache]:
+    for _, v in _iter_caches(**filters):
+        yield v
+
+
 def _iter_caches(group: Any = None,
                  module: str = None,
                  name: str = None) -> Iterator[Tuple[str, StatisticsCache]]:
@@ -101,19 +148,32 @@ def _iter_caches(group: Any = None,
         yield k, v
 
 
-def _cachekey(*args, **kwargs):
-    args = tuple(_as_tuple(a) for a in args)
-    kwargs = tuple((k, _as_tuple(v)) for k, v in kwargs.items())
-    return hash(tuple((args, kwargs)))
+def get_cache(module: str, name: str) -> Optional[StatisticsCache]:
+    """:returns: Cache of the function, None if caching is disabled."""
+
+    return _caches.get(module + '.' + name)
+
+
+#: Bytes of a dict slot and the hash of an entry, on top of its key and value.
+_ENTRY_OVERHEAD = 2 * 8 + 8
+
+
+def _sizeof(obj: Any) -> int:
+    """:returns: Size of the object and of the objects it holds directly."""
 
+    rv = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list)):
+        rv += sum(sys.getsizeof(x) for x in obj)
+    elif isinstance(obj, dict):
+        rv += sum(sys.getsizeof(x) for x in obj.values())
+    elif hasattr(obj, '__dict__'):
+        rv += sum(sys.getsizeof(x) for x in vars(obj).values())
+    return rv
 
-def _as_tuple(obj):
-    if isinstance(obj, dict):
-        return tuple(obj.items())
 
-    try:
-        iter(obj)
-    except TypeError:
-        return tuple([obj])
-    else:
-        return tuple(obj)
+#: Key under which `cached` stores result of the call.
+#:
+#: The key holds the arguments themselves, so they must be hashable. The
+#: lookup hashes them with their own `__hash__` and verifies a hit with their
+#: `__eq__`.
+cachekey = cachetools.keys.hashkey
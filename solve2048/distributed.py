@@ -0,0 +1,295 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import socket
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import rules
+
+_log = logging.getLogger()
+
+#: Number of moves after which a worker reports progress of its game.
+PROGRESS_INTERVAL = 10
+
+
+class Coordinator:
+    """Hands out seeded self-play games to workers over TCP and aggregates
+    their results.
+
+    Each line is a JSON message. A worker says `hello`, then the coordinator
+    sends it one `job` at a time, and the worker answers with `progress`
+    messages while playing and a `result` message at the end of the game.
+    A job of a worker which disconnects or stays silent for longer than
+    `timeout` is handed out again. When all the games are played, the
+    workers receive `done`.
+    """
+
+    def __init__(self,
+                 games: int,
+                 size: rules.Size,
+                 score: int,
+                 depth: int,
+                 seed: int = 0,
+                 timeout: float = 60.):
+        """
+        :param games: Number of games to play.
+        :param size: Size of the board.
+        :param score: Max score when the game ends.
+        :param depth: Search depth.
+        :param seed: Seed of the first game. Following games are seeded with
+            increasing seeds.
+        :param timeout: Seconds after which a silent worker is considered
+            dead.
+        """
+
+        self.size = size
+        self.score = score
+        self.depth = depth
+        self.timeout = timeout
+
+        self._jobs = collections.deque(range(seed, seed + games))
+        self._available = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._games = games
+
+        self.results: Dict[int, Dict[str, Any]] = {}
+        self.reassigned = 0
+        self.workers = 0
+        self.port = None
+
+    async def handle(self,
+                     reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        self.workers += 1
+        seed = None
+        try:
+            hello = await self._receive(reader)
+            name = hello.get('name') if hello else None
+            _log.info(f"Worker connected: {name}")
+
+            while True:
+                seed = await self._next_job()
+                if seed is None:
+                    await self._send(writer, dict(type='done'))
+                    break
+
+                await self._send(writer, dict(type='job',
+                                              seed=seed,
+                                              size=self.size,
+                                              score=self.score,
+                                              depth=self.depth))
+                while True:
+                    message = await self._receive(reader)
+                    if message is None:
+                        raise ConnectionError('Worker disconnected.')
+                    if message.get('seed') != seed:
+                        continue
+                    if message.get('type') == 'result':
+                        self._finish(seed, dict(message, worker=name))
+                        seed = None
+                        break
+        except (ConnectionError, asyncio.TimeoutError, ValueError) as e:
+            _log.warning(f"Worker lost: {e!r}")
+        finally:
+            self.workers -= 1
+            if seed is not None:
+                self._requeue(seed)
+            writer.close()
+
+    async def _next_job(self) -> Optional[int]:
+        """:returns: Seed of the next game, None if all the games are
+        played."""
+
+        while True:
+            if self._jobs:
+                return self._jobs.popleft()
+            if self._finished.is_set():
+                return None
+
+            # Wait until a job is requeued, or all the games are played.
+            self._available.clear()
+            waiters = [asyncio.ensure_future(self._available.wait()),
+                       asyncio.ensure_future(self._finished.wait())]
+            _, pending = await asyncio.wait(
+                waiters, return_when=asyncio.FIRST_COMPLETED)
+            for w in pending:
+                w.cancel()
+
+    def _requeue(self, seed: int) -> None:
+        if seed in self.results:
+            return
+        _log.warning(f"Reassigning game: {seed}")
+        self.reassigned += 1
+        self._jobs.append(seed)
+        self._available.set()
+
+    def _finish(self, seed: int, result: Dict[str, Any]) -> None:
+        self.results[seed] = result
+        _log.info(f"Game: {seed}. Won: {result['won']}. "
+                  f"Score: {result['score']}. Moves: {result['moves']}. "
+                  f"Worker: {result['worker']}")
+        if len(self.results) >= self._games:
+            self._finished.set()
+
+    async def _receive(self,
+                       reader: asyncio.StreamReader) -> Optional[Dict]:
+        line = await asyncio.wait_for(reader.readline(), self.timeout)
+        if not line:
+            return None
+        return json.loads(line)
+
+    async def _send(self,
+                    writer: asyncio.StreamWriter,
+                    message: Dict[str, Any]) -> None:
+        writer.write(json.dumps(message).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    async def run(self, host: str, port: int) -> Dict[str, Any]:
+        """Serves the workers until all the games are played.
+
+        :returns: Aggregated statistics.
+        """
+
+        start = time.perf_counter()
+        server = await asyncio.start_server(self.handle, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        _log.warning(f"Coordinating {self._games} games on {host}:{self.port}")
+
+        async with server:
+            if self._games:
+                await self._finished.wait()
+            # Let the connected workers receive `done`.
+            while self.workers:
+                await asyncio.sleep(0.01)
+
+        return aggregate(list(self.results.values()),
+                         time.perf_counter() - start,
+                         self.reassigned)
+
+
+def aggregate(results: List[Dict[str, Any]],
+              elapsed: float,
+              reassigned: int) -> Dict[str, Any]:
+    games = len(results)
+    moves = sum(r['moves'] for r in results)
+    return dict(games=games,
+                won=sum(r['won'] for r in results),
+                win_rate=sum(r['won'] for r in results) / (games or 1),
+                mean_score=sum(r['score'] for r in results) / (games or 1),
+                mean_moves=moves / (games or 1),
+                moves_per_second=moves / (elapsed or 0.001),
+                elapsed=elapsed,
+                reassigned=reassigned)
+
+
+def coordinate(host: str, port: int, **kwargs) -> Dict[str, Any]:
+    """Runs the coordinator until all the games are played.
+
+    :param host: Host to listen on.
+    :param port: Port to listen on.
+    :param kwargs: See `Coordinator`.
+    :returns: Aggregated statistics.
+    """
+
+    return asyncio.run(Coordinator(**kwargs).run(host, port))
+
+
+# Worker
+# -----------------------------------------------------------------------------
+
+def work(host: str, port: int, name: str = None) -> int:
+    """Plays the games handed out by the coordinator until it says `done`.
+
+    :param host: Host of the coordinator.
+    :param port: Port of the coordinator.
+    :param name: Name of the worker, reported to the coordinator.
+    :returns: Number of played games.
+    """
+
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    played = 0
+    with socket.create_connection((host, port)) as s:
+        f = s.makefile('rwb')
+
+        def send(message):
+            f.write(json.dumps(message).encode('utf-8') + b'\n')
+            f.flush()
+
+        send(dict(type='hello', name=name))
+        for line in f:
+            message = json.loads(line)
+            if message['type'] == 'done':
+                break
+            assert message['type'] == 'job'
+
+            seed = message['seed']
+
+            def progress(moves):
+                send(dict(type='progress', seed=seed, moves=moves))
+
+            result = play_game(seed=seed,
+                               size=tuple(message['size']),
+                               score=message['score'],
+                               depth=message['depth'],
+                               progress=progress)
+            send(dict(type='result', seed=seed, **result))
+            played += 1
+    return played
+
+
+def play_game(seed: int,
+              size: rules.Size,
+              score: int,
+              depth: int,
+              progress: Callable[[int], None] = None,
+              visit: Callable[[rules.Game2048], None] = None,
+              max_moves: int = None) -> Dict[str, Any]:
+    """Plays one game of MAX searching with expectimax against random MIN.
+
+    :param seed: Random seed of the game.
+    :param size: Size of the board.
+    :param score: Max score when the game ends.
+    :param depth: Search depth.
+    :param progress: Called with the number of moves every
+        `PROGRESS_INTERVAL` moves.
+    :param visit: Called with each game before MAX moves.
+    :param max_moves: Stop the game after this number of moves of MAX.
+    :returns: Whether MAX won, the reached score and the number of moves.
+    """
+
+    import search
+
+    random.seed(seed)
+    start = time.perf_counter()
+
+    game_ = rules.Game2048.initialize(size=size, terminal_score=score)
+    moves = 0
+    while game_.score() < score and (max_moves is None or moves < max_moves):
+        if visit:
+            visit(game_)
+        try:
+            action = search.expectimax_decision(
+                game_,
+                depth=depth,
+                alpha=game_.min_utility(),
+                beta=game_.max_utility())
+        except StopIteration:
+            break
+        game_ = game_.invoke(**action)
+        moves += 1
+
+        actions = game_.actions()
+        if actions:
+            game_ = game_.invoke(**random.choice(actions))
+
+        if progress and moves % PROGRESS_INTERVAL == 0:
+            progress(moves)
+
+    return dict(won=game_.score() >= score,
+                score=game_.score(),
+                moves=moves,
+                elapsed=time.perf_counter() - start)
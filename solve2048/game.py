@@ -27,9 +27,13 @@ class Game(Generic[T_State, T_Player]):
         return self._player
 
     @abc.abstractmethod
-    def terminal_test(self) -> bool:
+    def terminal_test(self, actions: List[Dict[str, Any]] = None) -> bool:
         """:returns: True if current state if the game is over, otherwise
-        False."""
+        False.
+
+        :param actions: Actions applicable in the current state, if already
+            known.
+        """
 
         pass
 
@@ -0,0 +1,76 @@
+import threading
+from typing import Callable, Optional
+
+import rules
+import search
+
+
+class HintSearch:
+    """Searches for the best direction in a background thread, so that the
+    player is not kept waiting for it.
+
+    Only one search runs at a time. Starting a search abandons the previous
+    one and waits for it to stop, so that the caches are never used by two
+    threads at once. The caches filled by an abandoned search are kept, and
+    speed up the following ones.
+    """
+
+    def __init__(self,
+                 depth: int,
+                 on_hint: Callable[[rules.Game2048, rules.Direction], None]):
+        """
+        :param depth: Search depth.
+        :param on_hint: Called from the background thread with the game and
+            its best direction, when the search finishes.
+        """
+
+        self.depth = depth
+        self.on_hint = on_hint
+        self._thread: Optional[threading.Thread] = None
+        self._cancelled = threading.Event()
+
+    def start(self, game_: rules.Game2048) -> None:
+        self.cancel()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(game_, self._cancelled),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self) -> None:
+        """Abandons the running search, if any, and waits for it to stop."""
+
+        if self._thread is not None:
+            self._cancelled.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, game_: rules.Game2048, cancelled: threading.Event) -> None:
+        try:
+            direction = best_direction(game_, self.depth, cancelled.is_set)
+        except search.SearchCancelled:
+            return
+        if direction is not None and not cancelled.is_set():
+            self.on_hint(game_, direction)
+
+
+def best_direction(game_: rules.Game2048,
+                   depth: int,
+                   cancelled: Callable[[], bool] = None
+                   ) -> Optional[rules.Direction]:
+    """:returns: Direction chosen by `search.expectimax_analysis` as in
+    `solve`, ties included, None if there is no applicable direction.
+
+    :param cancelled: See `search.expectimax_value`.
+    """
+
+    try:
+        action, _ = search.expectimax_analysis(game_,
+                                               depth=depth,
+                                               alpha=game_.min_utility(),
+                                               beta=game_.max_utility(),
+                                               iterative=True,
+                                               cancelled=cancelled)
+    except StopIteration:
+        return None
+    return action['direction']
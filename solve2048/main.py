@@ -1,16 +1,27 @@
 import argparse
+import contextlib
 import datetime
+import json
 import logging
+import os
 import random
 import sys
+import time
+from typing import IO, Callable, Tuple
 
 _log = logging.getLogger()
 
+#: Buffer size of the headless output, in bytes.
+_OUTPUT_BUFFER = 2 ** 16
+
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="2048 game.")
     parser.add_argument(
-        'action', choices=['solve', 'play'])
+        'action',
+        choices=['solve', 'play', 'replay', 'serve', 'analyze',
+                 'build-table', 'check-table', 'coordinate', 'work',
+                 'benchmark-evaluation', 'build-book'])
     parser.add_argument(
         '-ww', '--width', type=int, default=3,  # 4
         help="Width of the board.")
@@ -33,60 +44,338 @@ def main() -> None:
         '--cache-size', type=int, default=None,  # 32
         help="Cache size. (Actual cache size is 2 ** cache_size)")
     parser.add_argument(
-        '--search-algorithm', choices=['expectimax', 'minimax'],
+        '--search-algorithm',
+        choices=['expectimax', 'expectimax-iterative', 'expectimax-layered',
+                 'minimax'],
         default='expectimax',
         help="Search algorithm")
+    parser.add_argument(
+        '--samples', type=_int_list, default=None,
+        help="Comma separated max number of tile placements evaluated at "
+             "each chance node, for each ply from the root. The last value "
+             "applies to all deeper plies. 0 evaluates all placements. "
+             "Enables sampled expectimax.")
+    parser.add_argument(
+        '--full-evaluation-depth', type=int, default=None,
+        help="Evaluate leaves deeper than this number of plies with a cheap "
+             "estimate instead of the full heuristic. Searches of at most "
+             "this depth are not affected.")
+    parser.add_argument(
+        '--node-budget', type=int, default=None,
+        help="Search each move as deep as fits in this number of nodes, up "
+             "to --depth. The depth is chosen from the number of empty tiles "
+             "and applicable directions.")
+    parser.add_argument(
+        '--positions', type=int, default=100,
+        help="Number of positions to benchmark the evaluation on.")
+    parser.add_argument(
+        '--max-memory', type=int, default=None,
+        help="Memory limit of solve in MB. Caches are freed, the cheapest to "
+             "recompute first, when the process nears the limit.")
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help="Random seed.")
+    parser.add_argument(
+        '--record', default=None,
+        help="Path to the binary game record to write (solve) or read "
+             "(replay).")
+    parser.add_argument(
+        '--record-utilities', action='store_true',
+        help="Store utilities of the root actions in the game record.")
+    parser.add_argument(
+        '--table', default=None,
+        help="Path to the retrograde table to write (build-table) or read "
+             "(solve, check-table).")
+    parser.add_argument(
+        '--book', default=None,
+        help="Path to the policy book to write (build-book) or read "
+             "(solve).")
+    parser.add_argument(
+        '--book-depth', type=int, default=7,
+        help="Search depth of the positions in the policy book.")
+    parser.add_argument(
+        '--book-moves', type=int, default=200,
+        help="Number of moves of each self-play game to collect positions "
+             "for the policy book from.")
+    parser.add_argument(
+        '--book-size', type=int, default=10000,
+        help="Max number of positions in the policy book. The most frequent "
+             "positions of the self-play games are kept.")
+    parser.add_argument(
+        '--check-states', type=int, default=1000,
+        help="Number of states to check against the retrograde table.")
+    parser.add_argument(
+        '--shared-table-size', type=int, default=None,
+        help="Size of the transposition table shared by the worker processes "
+             "of serve and analyze. (Actual size is 2 ** shared_table_size "
+             "records)")
+    parser.add_argument(
+        '--socket', default='solve2048.sock',
+        help="Path to the UNIX socket to serve on.")
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help="Number of worker processes. Defaults to the number of CPUs.")
+    parser.add_argument(
+        '--no-hints', action='store_true',
+        help="Do not search for hints while playing.")
+    parser.add_argument(
+        '--host', default='127.0.0.1',
+        help="Host the coordinator listens on (coordinate) or connects to "
+             "(work).")
+    parser.add_argument(
+        '--port', type=int, default=2048,
+        help="Port the coordinator listens on (coordinate) or connects to "
+             "(work).")
+    parser.add_argument(
+        '--games', type=int, default=10,
+        help="Number of self-play games to coordinate, seeded from --seed.")
+    parser.add_argument(
+        '--worker-timeout', type=float, default=60.,
+        help="Seconds after which a silent worker is considered dead and its "
+             "game is reassigned.")
+    parser.add_argument(
+        '--input', default='-',
+        help="Path to the boards to analyze. - for standard input.")
+    parser.add_argument(
+        '--output', default='-',
+        help="Path to write the analysis (analyze) or the headless records "
+             "(solve) to. - for standard output.")
+    parser.add_argument(
+        '--headless', choices=['move', 'game'], default=None,
+        help="Do not print the game, and write one JSON record per move or "
+             "per game to --output instead.")
+    parser.add_argument(
+        '--input-format', choices=['jsonl', 'csv'], default=None,
+        help="Format of the boards to analyze. Defaults to the extension of "
+             "--input, or jsonl.")
+    parser.add_argument(
+        '--batch-size', type=int, default=256,
+        help="Number of boards to analyze at once.")
+    parser.add_argument(
+        '--symmetric', action='store_true',
+        help="Analyze boards which are rotations or reflections of each "
+             "other only once.")
 
     args = parser.parse_args()
+    if args.action in ('build-table', 'check-table') and not args.table:
+        parser.error(f"{args.action} requires --table")
+    if args.table and args.action not in ('solve', 'build-table',
+                                          'check-table'):
+        parser.error(f"--table is not supported by {args.action}")
+    if args.max_memory and args.action != 'solve':
+        parser.error(f"--max-memory is not supported by {args.action}")
+    if args.headless and args.action != 'solve':
+        parser.error(f"--headless is not supported by {args.action}")
+    if args.no_hints and args.action != 'play':
+        parser.error(f"--no-hints is not supported by {args.action}")
+    if args.action == 'build-book' and not args.book:
+        parser.error("build-book requires --book")
+    if args.book and args.action not in ('solve', 'build-book'):
+        parser.error(f"--book is not supported by {args.action}")
+    if args.shared_table_size and args.action not in ('serve', 'analyze'):
+        parser.error(f"--shared-table-size is not supported by {args.action}")
+    if args.samples and args.search_algorithm == 'minimax':
+        parser.error("--samples requires expectimax")
+    if args.full_evaluation_depth is not None and \
+            (args.samples or args.search_algorithm == 'minimax'):
+        parser.error("--full-evaluation-depth requires expectimax without "
+                     "--samples")
+    if args.node_budget and (args.action != 'solve'
+                             or args.samples
+                             or args.search_algorithm not in (
+                                 'expectimax', 'expectimax-iterative')):
+        parser.error("--node-budget requires solve with expectimax without "
+                     "--samples")
+    if args.node_budget and args.depth < 0:
+        parser.error("--node-budget requires a limited --depth")
+    if args.node_budget and args.max_memory:
+        # Flushed caches change which nodes the budget counts, and flushes
+        # depend on the memory of the machine.
+        parser.error("--node-budget does not support --max-memory")
+    if args.action == 'benchmark-evaluation' and \
+            args.full_evaluation_depth is None:
+        parser.error("benchmark-evaluation requires --full-evaluation-depth")
+    if args.action == 'replay' and not args.record:
+        parser.error("replay requires --record")
+    if args.record and args.action not in ('solve', 'replay'):
+        parser.error(f"--record is not supported by {args.action}")
+    if args.record_utilities and (args.action != 'solve' or not args.record):
+        parser.error("--record-utilities requires solve with --record")
+    if args.action == 'build-table':
+        import retrograde
+        if retrograde.state_bound((args.height, args.width),
+                                  args.score) > retrograde.MAX_STATES:
+            parser.error(f"--score {args.score} is too large for the table of "
+                         f"{args.height}x{args.width} boards")
+    if args.table and args.action == 'solve':
+        import retrograde
+        _check_file(parser, args, 'table', retrograde.Table)
+    if args.book and args.action == 'solve':
+        import book
+        _check_file(parser, args, 'book', book.Book)
     setup_logging(args)
 
-    random.seed(0)
-    sys.setrecursionlimit(1500)
-
-    if args.cache_size:
-        import cache
-        cache.CACHE_MAXSIZE = 2 ** args.cache_size
+    import utils
+    utils.setup_process(args.seed, args.cache_size)
 
     if args.action == 'solve':
         solve(args)
+    elif args.action == 'replay':
+        replay(args)
+    elif args.action == 'serve':
+        serve(args)
+    elif args.action == 'analyze':
+        analyze(args)
+    elif args.action == 'build-table':
+        build_table(args)
+    elif args.action == 'check-table':
+        check_table(args)
+    elif args.action == 'coordinate':
+        coordinate(args)
+    elif args.action == 'work':
+        work(args)
+    elif args.action == 'benchmark-evaluation':
+        benchmark_evaluation(args)
+    elif args.action == 'build-book':
+        build_book(args)
     else:
         assert args.action == 'play'
         play(args)
 
 
 def solve(args: argparse.Namespace) -> None:
+    import book
+    import memory
+    import record
+    import retrograde
     import rules
-    import search
 
     game_ = rules.Game2048.initialize(
         size=(args.height, args.width),
         terminal_score=args.score)
 
+    with contextlib.ExitStack() as stack:
+        writer = None
+        if args.record:
+            writer = stack.enter_context(record.RecordWriter(
+                args.record,
+                size=game_.size,
+                seed=args.seed,
+                score=args.score,
+                config=dict(depth=args.depth,
+                            search_algorithm=args.search_algorithm,
+                            samples=args.samples,
+                            full_evaluation_depth=args.full_evaluation_depth,
+                            node_budget=args.node_budget),
+                utilities=args.record_utilities))
+
+        table = None
+        if args.table:
+            table = stack.enter_context(retrograde.Table(args.table))
+
+        book_ = None
+        if args.book:
+            book_ = stack.enter_context(book.Book(args.book))
+
+        output = None
+        if args.headless:
+            if args.output == '-':
+                output = sys.stdout
+            else:
+                output = stack.enter_context(
+                    open(args.output, 'w', buffering=_OUTPUT_BUFFER))
+
+        governor = None
+        if args.max_memory:
+            governor = memory.MemoryGovernor(args.max_memory * 2 ** 20)
+
+        _solve(args, game_, writer, table, book_, output, governor)
+
+
+def _solve(args: argparse.Namespace,
+           game_,
+           writer,
+           table,
+           book_,
+           output: IO[str] = None,
+           governor=None) -> None:
+    import record
+    import search
+
+    # Headless mode prints nothing per move, and writes the records to the
+    # output instead.
+    headless = args.headless is not None
+    echo = _silent if headless else print
+
+    start = time.perf_counter()
+    moves = 0
     i = 0
     dt = None
+    hits = 0
     while True:
-        print("\n---------------------------------------------")
-        update_statistics(game_, i, dt)
+        if governor:
+            governor.check()
+        if not headless:
+            print("\n---------------------------------------------")
+            update_statistics(game_, i, dt)
         i += 1
         dt = datetime.datetime.now()
 
         if game_.score() >= args.score:
-            print("\n---------------------------------------------")
-            print("\nAI won!")
+            echo("\n---------------------------------------------")
+            echo("\nAI won!")
+            if writer:
+                writer.write(game_)
             break
 
         # Max's (AI player) ply
 
         try:
-            if args.search_algorithm == 'expectimax':
-                action = search.expectimax_decision(
+            errors = {}
+            hit = table.lookup(game_) if table else None
+            direction = None
+            if not hit and book_:
+                direction = book_.lookup(game_)
+                hits += direction is not None
+                echo(f"\nBook hits: {hits}/{i}")
+            if hit:
+                direction, p = hit
+                action = dict(player=+1, direction=direction)
+                utilities = []
+                echo(f"\nTable: win probability {p:.6f}")
+            elif direction:
+                action = dict(player=+1, direction=direction)
+                utilities = []
+            elif args.node_budget:
+                action, utilities, depth, aborted = \
+                    search.budgeted_expectimax_analysis(
+                        game_,
+                        budget=args.node_budget,
+                        max_depth=args.depth,
+                        full_depth=args.full_evaluation_depth)
+                echo(f"\nDepth: {depth}. Abandoned searches: {aborted}")
+            elif args.samples:
+                action, sampled = search.sampled_expectimax_analysis(
+                    game_,
+                    depth=args.depth,
+                    samples=args.samples,
+                    seed=args.seed)
+                utilities = [(a, v) for a, v, _ in sampled]
+                errors = {a['direction']: e for a, _, e in sampled}
+            elif args.search_algorithm in ('expectimax',
+                                           'expectimax-iterative',
+                                           'expectimax-layered'):
+                action, utilities = search.expectimax_analysis(
                     game_,
                     depth=args.depth,
                     alpha=game_.min_utility(),
-                    beta=game_.max_utility())
+                    beta=game_.max_utility(),
+                    iterative=args.search_algorithm == 'expectimax-iterative',
+                    layered=args.search_algorithm == 'expectimax-layered',
+                    full_depth=args.full_evaluation_depth)
             else:
                 assert args.search_algorithm == 'minimax'
-                action = search.expectimax_decision(
+                action, utilities = search.expectimax_analysis(
                     game_,
                     depth=args.depth,
                     alpha=game_.min_utility(),
@@ -94,28 +383,292 @@ def solve(args: argparse.Namespace) -> None:
         except KeyboardInterrupt:
             break
         except StopIteration:
-            print("\n---------------------------------------------")
-            print("\nAI lost!")
+            echo("\n---------------------------------------------")
+            echo("\nAI lost!")
+            if writer:
+                writer.write(game_)
             break
         else:
-            print(f"\n{action['direction'].name}")
+            if not headless:
+                print(f"\n{action['direction'].name}")
+                for a, v in utilities:
+                    d = a['direction']
+                    error = f" ± {errors[d]:.2f}" if d in errors else ""
+                    _log.info(f"\t{d.name}\tUtility: {v:.2f}{error}")
+            previous = game_
             game_ = game_.invoke(**action)
+            moves += 1
 
         # Min's (opponent) ply
 
+        spawn = None
         actions = game_.actions()
+        if actions:
+            spawn = random.choice(actions)
+            game_ = game_.invoke(**spawn)
+
+        if writer:
+            writer.write(previous,
+                         direction=action['direction'],
+                         spawn=spawn['position'] if spawn else None,
+                         utilities=record.utilities_by_direction(utilities))
+
+        if args.headless == 'move':
+            _write_record(output,
+                          move=moves,
+                          direction=action['direction'].name,
+                          spawn=spawn['position'] if spawn else None,
+                          score=game_.score())
+
+    if headless:
+        elapsed = time.perf_counter() - start
+        if args.headless == 'game':
+            _write_record(output,
+                          seed=args.seed,
+                          won=game_.score() >= args.score,
+                          score=game_.score(),
+                          moves=moves,
+                          elapsed=elapsed)
+        output.flush()
+        _log.warning(f"Moves: {moves}. "
+                     f"Elapsed: {elapsed:.6f}. "
+                     f"Moves/s: {moves / (elapsed or 0.001):.2f}")
+
+
+def _write_record(output: IO[str], **kwargs) -> None:
+    output.write(json.dumps(kwargs, separators=(',', ':')))
+    output.write('\n')
+
+
+def _silent(*args, **kwargs) -> None:
+    pass
+
+
+def replay(args: argparse.Namespace) -> None:
+    import record
+
+    header = record.read_header(args.record)
+    print(f"Size: {header.size}. Seed: {header.seed}. "
+          f"Score: {header.score}. Config: {header.config}")
+
+    for i, r in enumerate(record.read_records(args.record)):
+        print("\n---------------------------------------------")
+        game_ = r.to_game()
+        print(f"\n{game_}")
+        print(f"\nIteration: {i}. Score: {game_.score()}. "
+              f"Spawn: {r.spawn}")
+        if r.utilities:
+            for d, v in r.utilities.items():
+                _log.info(f"\t{d.name}\tUtility: {v:.2f}")
+        if r.direction:
+            print(f"\n{r.direction.name}")
+
+
+def serve(args: argparse.Namespace) -> None:
+    import server
+
+    workers = args.workers or os.cpu_count() or 1
+    with _shared_table(args, workers) as table:
+        server.serve(args.socket,
+                     workers=workers,
+                     size=(args.height, args.width),
+                     depth=args.depth,
+                     score=args.score,
+                     seed=args.seed,
+                     cache_size=args.cache_size,
+                     table=table)
+
+
+def analyze(args: argparse.Namespace) -> None:
+    import analysis
+
+    input_format = args.input_format
+    if input_format is None:
+        input_format = 'csv' if args.input.endswith('.csv') else 'jsonl'
+
+    size = (args.height, args.width)
+    workers = args.workers or os.cpu_count() or 1
+    with contextlib.ExitStack() as stack:
+        table = stack.enter_context(_shared_table(args, workers))
+        if args.input == '-':
+            input_ = sys.stdin
+        else:
+            input_ = stack.enter_context(open(args.input, newline=''))
+        if args.output == '-':
+            output = sys.stdout
+        else:
+            output = stack.enter_context(open(args.output, 'w'))
+
+        if input_format == 'csv':
+            boards = analysis.read_csv(input_, size)
+        else:
+            assert input_format == 'jsonl'
+            boards = analysis.read_jsonl(input_)
+
+        results = analysis.analyze_stream(
+            boards,
+            size=size,
+            depth=args.depth,
+            score=args.score,
+            workers=workers,
+            batch_size=args.batch_size,
+            symmetric=args.symmetric,
+            seed=args.seed,
+            cache_size=args.cache_size,
+            table=table)
+        analysis.write_jsonl(results, output)
+
+
+def _shared_table(args: argparse.Namespace, workers: int):
+    """:returns: Context of the shared transposition table, None if it was
+    not requested."""
+
+    import transposition
+
+    if not args.shared_table_size:
+        return contextlib.nullcontext()
+    return transposition.SharedTable(size=(args.height, args.width),
+                                     terminal_score=args.score,
+                                     capacity=2 ** args.shared_table_size,
+                                     processes=workers)
+
+
+def build_book(args: argparse.Namespace) -> None:
+    import book
+
+    start = datetime.datetime.now()
+    count = book.build(args.book,
+                       size=(args.height, args.width),
+                       terminal_score=args.score,
+                       depth=args.depth,
+                       games=args.games,
+                       moves=args.book_moves,
+                       positions=args.book_size,
+                       book_depth=args.book_depth,
+                       workers=args.workers or os.cpu_count() or 1,
+                       seed=args.seed,
+                       cache_size=args.cache_size)
+    elapsed = (datetime.datetime.now() - start).total_seconds()
+    print(f"Positions: {count}. Elapsed: {elapsed}.")
+
+
+def build_table(args: argparse.Namespace) -> None:
+    import retrograde
+
+    start = datetime.datetime.now()
+    count = retrograde.build(args.table,
+                             size=(args.height, args.width),
+                             terminal_score=args.score)
+    elapsed = (datetime.datetime.now() - start).total_seconds()
+    print(f"States: {count}. Elapsed: {elapsed}.")
+
+
+def check_table(args: argparse.Namespace) -> None:
+    import retrograde
+    import search
+
+    def decide(game_):
+        action = search.expectimax_decision(
+            game_,
+            depth=args.depth,
+            alpha=game_.min_utility(),
+            beta=game_.max_utility())
+        return action['direction']
+
+    with retrograde.Table(args.table) as table:
+        checked, optimal, loss = retrograde.check(table,
+                                                  decide,
+                                                  states=args.check_states)
+    print(f"Checked: {checked}. "
+          f"Optimal: {optimal / (checked or 1) * 100:.2f}%. "
+          f"Mean loss of win probability: {loss:.6f}.")
+
+
+def benchmark_evaluation(args: argparse.Namespace) -> None:
+    import rules
+    import search
+
+    # Positions from games of random moves, with a generator of their own so
+    # that the positions do not depend on the searches.
+    rng = random.Random(args.seed)
+    games = []
+    game_ = None
+    while len(games) < args.positions:
+        actions = game_.actions() if game_ else None
         if not actions:
+            game_ = rules.Game2048(
+                {(i, j): None
+                 for i in range(args.height)
+                 for j in range(args.width)},
+                player=-1,
+                size=(args.height, args.width),
+                terminal_score=args.score)
             continue
-        game_ = game_.invoke(**random.choice(actions))
+        game_ = game_.invoke(**rng.choice(actions))
+        if game_.player == +1 and game_.actions():
+            games.append(game_)
+
+    stats = search.benchmark_evaluation(games,
+                                        depth=args.depth,
+                                        full_depth=args.full_evaluation_depth)
+    full = stats['full_seconds_per_decision']
+    tiered = stats['tiered_seconds_per_decision']
+    print(f"Positions: {stats['positions']}. "
+          f"Full: {full * 1000:.2f} ms/decision, "
+          f"{stats['full_nodes_per_second']:.2f} nodes/s. "
+          f"Tiered: {tiered * 1000:.2f} ms/decision, "
+          f"{stats['tiered_nodes_per_second']:.2f} nodes/s. "
+          f"Gain: {full / (tiered or 0.001):.2f}x. "
+          f"Agreement: {stats['agreement'] * 100:.2f}%.")
+
+
+def coordinate(args: argparse.Namespace) -> None:
+    import distributed
+
+    stats = distributed.coordinate(args.host,
+                                   args.port,
+                                   games=args.games,
+                                   size=(args.height, args.width),
+                                   score=args.score,
+                                   depth=args.depth,
+                                   seed=args.seed,
+                                   timeout=args.worker_timeout)
+    print(f"Games: {stats['games']}. "
+          f"Won: {stats['won']} ({stats['win_rate'] * 100:.2f}%). "
+          f"Mean score: {stats['mean_score']:.2f}. "
+          f"Mean moves: {stats['mean_moves']:.2f}. "
+          f"Moves/s: {stats['moves_per_second']:.2f}. "
+          f"Reassigned: {stats['reassigned']}. "
+          f"Elapsed: {stats['elapsed']}.")
+
+
+def work(args: argparse.Namespace) -> None:
+    import distributed
+
+    try:
+        played = distributed.work(args.host, args.port)
+    except KeyboardInterrupt:
+        return
+    print(f"Games: {played}.")
 
 
 def play(args: argparse.Namespace) -> None:
+    import hints
     import rules
 
     game_ = rules.Game2048.initialize(
         size=(args.height, args.width),
         terminal_score=args.score)
 
+    prompt = "Type W for UP, A for LEFT, S for DOWN and D for RIGHT:  "
+
+    def on_hint(_, direction):
+        print(f"\nHint: {direction.name}\n{prompt}", end='', flush=True)
+
+    hint_search = None
+    if not args.no_hints:
+        hint_search = hints.HintSearch(args.depth, on_hint)
+
     i = 0
     dt = None
     while True:
@@ -137,9 +690,14 @@ def play(args: argparse.Namespace) -> None:
             print("You lost!")
             break
 
-        print("Type W for UP, A for LEFT, S for DOWN and D for RIGHT:  ",
-              end='')
-        s = input().lower()
+        print(prompt, end='', flush=True)
+        if hint_search:
+            hint_search.start(game_)
+        try:
+            s = input().lower()
+        finally:
+            if hint_search:
+                hint_search.cancel()
         if s == 'w':
             direction = rules.Direction.UP
         elif s == 's':
@@ -188,6 +746,32 @@ def update_statistics(game_, i, dt):
     print()
 
 
+def _check_file(parser: argparse.ArgumentParser,
+                args: argparse.Namespace,
+                name: str,
+                open_: Callable) -> None:
+    """Exits with an error unless the file of the option opens and matches
+    the board size and --score."""
+
+    path = getattr(args, name)
+    try:
+        with open_(path) as f:
+            size, terminal_score = f.size, f.terminal_score
+    except (OSError, ValueError) as e:
+        parser.error(f"--{name} {path}: {e}")
+    if size != (args.height, args.width) or terminal_score != args.score:
+        parser.error(f"--{name} {path} is for {size[0]}x{size[1]} boards "
+                     f"and --score {terminal_score}, not "
+                     f"{args.height}x{args.width} and --score {args.score}")
+
+
+def _int_list(value: str) -> Tuple[int, ...]:
+    rv = tuple(int(x) for x in value.split(','))
+    if any(x < 0 for x in rv):
+        raise ValueError(value)
+    return rv
+
+
 def setup_logging(args: argparse.Namespace) -> None:
     log = logging.getLogger()
     if args.debug:
@@ -0,0 +1,154 @@
+import logging
+import os
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+import cache
+
+_log = logging.getLogger()
+
+_MB = 2 ** 20
+
+#: Caches which are the cheapest to recompute, flushed first.
+_CHEAP_CACHES = [('rules', 'can_invoke'), ('rules', 'actions')]
+
+
+def rss() -> int:
+    """:returns: Resident set size of the process in bytes. Peak resident
+    set size where the current one is not available."""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        import sys
+
+        rv = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rv if sys.platform == 'darwin' else rv * 1024
+
+
+class MemoryGovernor:
+    """Keeps the process within a memory limit by freeing the caches.
+
+    Caches are freed in order of how cheap their entries are to recompute:
+    first `can_invoke` and `actions`, then the search entries of the
+    shallowest depths, one depth at a time, and at last all the other
+    caches, the largest first.
+
+    The allocator rarely returns freed memory to the system, so the resident
+    set size does not drop after the caches are freed. Instead, the freed
+    bytes are taken as reusable until the caches grow back by as much.
+    """
+
+    def __init__(self,
+                 limit: int,
+                 threshold: float = 0.9,
+                 target: float = 0.75,
+                 rss_: Callable[[], int] = rss):
+        """
+        :param limit: Memory limit in bytes.
+        :param threshold: Caches are freed once the memory in use exceeds
+            this share of the limit.
+        :param target: ... until the memory in use drops to this share of the
+            limit.
+        :param rss_: Returns the memory in use.
+        """
+
+        self.limit = limit
+        self.threshold = threshold
+        self.target = target
+        self._rss = rss_
+        self._reusable = 0
+        self._floor = 0
+        self.interventions = 0
+
+    def used(self) -> int:
+        """:returns: Memory in use, without the freed memory which was not
+        reused yet."""
+
+        return self._rss() - self._unused()
+
+    def _unused(self) -> int:
+        """:returns: Freed memory which was not reused yet."""
+
+        grown = max(0, _cache_bytes() - self._floor)
+        return max(0, self._reusable - grown)
+
+    def check(self) -> int:
+        """Frees the caches if the memory in use exceeds the threshold.
+
+        :returns: Estimated number of freed bytes.
+        """
+
+        used = self.used()
+        if used <= self.threshold * self.limit:
+            return 0
+
+        excess = used - self.target * self.limit
+        freed = 0
+        for name, free in self._steps():
+            entries, size = free()
+            if not entries:
+                continue
+            freed += size
+            self.interventions += 1
+            _log.warning(f"Memory: {used / _MB:.1f} of "
+                         f"{self.limit / _MB:.1f} MB. "
+                         f"Freed {name}: {entries} entries, "
+                         f"~{size / _MB:.1f} MB.")
+            if freed >= excess:
+                break
+
+        self._reusable = self._unused() + freed
+        self._floor = _cache_bytes()
+        return freed
+
+    def _steps(self) -> Iterator[Tuple[str, Callable[[], Tuple[int, int]]]]:
+        """:returns: Names and functions freeing the caches, in order. Each
+        function returns the number of freed entries and their estimated
+        bytes."""
+
+        for module, name in _CHEAP_CACHES:
+            c = cache.get_cache(module, name)
+            if c is not None:
+                yield f"{module}.{name}", lambda c=c: _clear(c)
+
+        searches = list(cache.iter_caches(module='search'))
+        depths = {d for c in searches for d in map(_depth, c) if d is not None}
+        for depth in sorted(depths):
+            for c in searches:
+                yield (f"search.{c.name} depth {depth}",
+                       lambda c=c, depth=depth: _drop_depth(c, depth))
+
+        for c in sorted(cache.iter_caches(),
+                        key=lambda c: c.estimate_bytes(),
+                        reverse=True):
+            yield f"{c.module}.{c.name}", lambda c=c: _clear(c)
+
+
+def _cache_bytes() -> int:
+    return sum(c.estimate_bytes() for c in cache.iter_caches())
+
+
+def _clear(c: cache.StatisticsCache) -> Tuple[int, int]:
+    rv = len(c), c.estimate_bytes()
+    c.clear()
+    return rv
+
+
+def _drop_depth(c: cache.StatisticsCache, depth: int) -> Tuple[int, int]:
+    count = len(c)
+    size = c.estimate_bytes()
+    dropped = c.drop(lambda k: _depth(k) == depth)
+    return dropped, size * dropped // (count or 1)
+
+
+def _depth(key: Any) -> Optional[int]:
+    """:returns: Depth in the cache key, None if there is none or the depth
+    is unlimited."""
+
+    for i, k in enumerate(key[:-1]):
+        if isinstance(k, str) and k == 'depth':
+            depth = key[i + 1]
+            return depth if depth >= 0 else None
+    return None
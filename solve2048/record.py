@@ -0,0 +1,261 @@
+import json
+import math
+import mmap
+import os
+import struct
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import rules
+
+#: File starts with the magic, followed by the header and fixed-width move
+#: records.
+#:
+#: Header: version, height, width, flags, seed, terminal score, length of the
+#: config and the config itself (JSON encoded).
+#:
+#: Move record: direction (0 if no move was made), spawn position (index into
+#: the board in row-major order, 0xff if no tile was spawned), board (one byte
+#: per tile holding its exponent, 0 for empty tiles) and optionally the
+#: utilities of the root actions (one double per `Direction`, NaN if the
+#: direction was not applicable).
+MAGIC = b'S2048REC'
+VERSION = 1
+
+FLAG_UTILITIES = 0x01
+
+NO_DIRECTION = 0
+NO_SPAWN = 0xff
+
+_HEADER = struct.Struct('<BBBBqQI')
+_MOVE = struct.Struct('<BB')
+_UTILITIES = struct.Struct('<' + 'd' * len(rules.Direction))
+
+_DIRECTIONS = list(rules.Direction)
+
+
+class Header(NamedTuple):
+    size: rules.Size
+    seed: int
+    score: int
+    config: Dict[str, Any]
+    utilities: bool
+
+
+class MoveRecord(NamedTuple):
+    header: Header
+    board: bytes
+    direction: Optional[rules.Direction]
+    spawn: Optional[rules.Position]
+    utilities: Optional[Dict[rules.Direction, float]]
+
+    def to_game(self) -> rules.Game2048:
+        """:returns: Game, as it was before the move was made."""
+
+        return rules.Game2048(unpack_board(self.board, self.header.size),
+                              player=+1,
+                              size=self.header.size,
+                              terminal_score=self.header.score)
+
+
+class RecordWriter:
+    """Streams game records into a file."""
+
+    def __init__(self,
+                 path: str,
+                 size: rules.Size,
+                 seed: int,
+                 score: int,
+                 config: Dict[str, Any],
+                 utilities: bool = False):
+        """
+        :param path: Path of the file to write.
+        :param size: Size of the board.
+        :param seed: Random seed the game was played with.
+        :param score: Max score when the game ends.
+        :param config: Configuration of the solver (JSON serializable).
+        :param utilities: Whether to store utilities of the root actions.
+        """
+
+        self.header = Header(size, seed, score, config, utilities)
+        self._file = open(path, 'wb')
+        self._file.write(pack_header(self.header))
+
+    def write(self,
+              game_: rules.Game2048,
+              direction: rules.Direction = None,
+              spawn: rules.Position = None,
+              utilities: Dict[rules.Direction, float] = None) -> None:
+        """Appends one move.
+
+        :param game_: Game before the move was made.
+        :param direction: Direction chosen by the player.
+        :param spawn: Position of the tile spawned after the move.
+        :param utilities: Utilities of the root actions.
+        """
+
+        height, width = self.header.size
+        self._file.write(_MOVE.pack(
+            _DIRECTIONS.index(direction) + 1 if direction else NO_DIRECTION,
+            spawn[0] * width + spawn[1] if spawn else NO_SPAWN))
+        self._file.write(pack_board(game_.state, self.header.size))
+        if self.header.utilities:
+            utilities = utilities or {}
+            self._file.write(_UTILITIES.pack(
+                *(utilities.get(d, math.nan) for d in _DIRECTIONS)))
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> 'RecordWriter':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def read_records(path: str) -> Iterator[MoveRecord]:
+    """Iterates through the moves in the file without loading it into memory.
+
+    :param path: Path of the file to read.
+    :returns: Generator of move records.
+    :raises ValueError: If the file is not a game record or if it ends with
+        a partial move record.
+    """
+
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            raise ValueError('Not a game record: the file is empty.')
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            header, offset = unpack_header(m)
+            height, width = header.size
+            length = record_size(header)
+
+            if (len(m) - offset) % length:
+                raise ValueError(
+                    f'Truncated game record: {(len(m) - offset) % length} '
+                    f'trailing bytes do not form a move record of '
+                    f'{length} bytes.')
+
+            while offset < len(m):
+                direction, spawn = _MOVE.unpack_from(m, offset)
+                board = m[offset + _MOVE.size:
+                          offset + _MOVE.size + height * width]
+
+                utilities = None
+                if header.utilities:
+                    values = _UTILITIES.unpack_from(
+                        m, offset + _MOVE.size + height * width)
+                    utilities = {d: v for d, v in zip(_DIRECTIONS, values)
+                                 if not math.isnan(v)}
+
+                yield MoveRecord(
+                    header,
+                    board,
+                    _DIRECTIONS[direction - 1] if direction else None,
+                    divmod(spawn, width) if spawn != NO_SPAWN else None,
+                    utilities)
+
+                offset += length
+
+
+def read_header(path: str) -> Header:
+    """Reads only the header, without touching the move records.
+
+    :param path: Path of the file to read.
+    """
+
+    with open(path, 'rb') as f:
+        fixed = f.read(len(MAGIC) + _HEADER.size)
+        *_, length = _unpack_fixed_header(fixed)
+        header, _ = unpack_header(fixed + f.read(length))
+        return header
+
+
+def record_size(header: Header) -> int:
+    """:returns: Size of a move record in bytes."""
+
+    height, width = header.size
+    rv = _MOVE.size + height * width
+    if header.utilities:
+        rv += _UTILITIES.size
+    return rv
+
+
+# Packing
+# -----------------------------------------------------------------------------
+
+def pack_header(header: Header) -> bytes:
+    height, width = header.size
+    config = json.dumps(header.config, sort_keys=True).encode('utf-8')
+    flags = FLAG_UTILITIES if header.utilities else 0
+    return b''.join((
+        MAGIC,
+        _HEADER.pack(VERSION,
+                     height,
+                     width,
+                     flags,
+                     header.seed,
+                     header.score,
+                     len(config)),
+        config))
+
+
+def unpack_header(buffer) -> Tuple[Header, int]:
+    """
+    :param buffer: Bytes-like object the file starts with.
+    :returns: Header and offset of the first move record.
+    :raises ValueError: If the buffer does not start with a complete header.
+    """
+
+    version, height, width, flags, seed, score, length = \
+        _unpack_fixed_header(buffer)
+
+    offset = len(MAGIC) + _HEADER.size
+    if offset + length > len(buffer):
+        raise ValueError('Truncated game record: incomplete header.')
+    config = json.loads(bytes(buffer[offset:offset + length]))
+
+    header = Header((height, width),
+                    seed,
+                    score,
+                    config,
+                    bool(flags & FLAG_UTILITIES))
+    return header, offset + length
+
+
+def _unpack_fixed_header(buffer) -> Tuple[int, ...]:
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError('Not a game record: missing magic.')
+    if len(buffer) < len(MAGIC) + _HEADER.size:
+        raise ValueError('Truncated game record: incomplete header.')
+
+    rv = _HEADER.unpack_from(buffer, len(MAGIC))
+    version = rv[0]
+    if version != VERSION:
+        raise ValueError(f'Unsupported game record version: {version}.')
+    return rv
+
+
+def pack_board(board: rules.Board, size: rules.Size) -> bytes:
+    """:returns: Exponents of the tiles in row-major order."""
+
+    height, width = size
+    return bytes((board[(i, j)] or 1).bit_length() - 1
+                 for i in range(height)
+                 for j in range(width))
+
+
+def unpack_board(data: bytes, size: rules.Size) -> rules.Board:
+    height, width = size
+    return {(i, j): 2 ** data[i * width + j] if data[i * width + j] else None
+            for i in range(height)
+            for j in range(width)}
+
+
+def utilities_by_direction(
+        utilities: List[Tuple[Dict[str, Any], float]]
+) -> Dict[rules.Direction, float]:
+    """:returns: Utilities of the root actions keyed by their direction."""
+
+    return {a['direction']: v for a, v in utilities}
@@ -0,0 +1,334 @@
+import itertools
+import logging
+import mmap
+import struct
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import rules
+
+_log = logging.getLogger()
+
+#: File starts with the magic, followed by the header (version, height,
+#: width, exponent of the terminal score and number of states), the sorted
+#: keys of the states, the win probabilities and the best directions.
+#:
+#: Key of a state packs exponents of its tiles in row-major order, 4 bits per
+#: tile, the first tile in the lowest bits. Only states where MAX is to move
+#: and can move, and which are not won yet are stored.
+MAGIC = b'S2048TBL'
+VERSION = 1
+
+_HEADER = struct.Struct('<BBBBQ')
+_KEY = struct.Struct('<Q')
+_PROBABILITY = struct.Struct('<d')
+
+_DIRECTIONS = list(rules.Direction)
+
+#: Exponents of the tiles in row-major order.
+Tiles = Tuple[int, ...]
+
+#: Max of `state_bound` accepted by `build`. 3x3 boards to 64 and 2x4 boards
+#: to 256 stay within it, and build in a couple of minutes.
+MAX_STATES = 5 * 10 ** 7
+
+
+class Table:
+    """Exact win probabilities and the best directions, looked up in a file
+    built by `build`."""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        m = self._mmap
+        if m[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a retrograde table.')
+        version, height, width, exponent, count = \
+            _HEADER.unpack_from(m, len(MAGIC))
+        if version != VERSION:
+            raise ValueError(f'Unsupported retrograde table version: '
+                             f'{version}.')
+
+        self.size = (height, width)
+        self.terminal_score = 2 ** exponent
+        self.count = count
+
+        self._keys = len(MAGIC) + _HEADER.size
+        self._probabilities = self._keys + count * _KEY.size
+        self._directions = self._probabilities + count * _PROBABILITY.size
+        if len(m) != self._directions + count:
+            raise ValueError('Truncated retrograde table.')
+
+    def lookup(self, game_: rules.Game2048
+               ) -> Optional[Tuple[rules.Direction, float]]:
+        """:returns: Best direction and win probability of MAX, None if the
+        state is not in the table."""
+
+        if game_.size != self.size or \
+                game_.terminal_score != self.terminal_score:
+            raise ValueError('Game does not match the table.')
+
+        i = self._index(pack(tiles(game_)))
+        if i is None:
+            return None
+        return self._entry(i)
+
+    def probability(self, state: Tiles) -> float:
+        """:returns: Win probability of MAX in the state, where MAX is to
+        move."""
+
+        if max(state) >= self.terminal_score.bit_length() - 1:
+            return 1.
+        i = self._index(pack(state))
+        if i is None:
+            return 0.  # no move is applicable
+        return self._entry(i)[1]
+
+    def __iter__(self) -> Iterator[Tuple[Tiles, rules.Direction, float]]:
+        """:returns: All states with their best direction and win
+        probability."""
+
+        for i in range(self.count):
+            key, = _KEY.unpack_from(self._mmap, self._keys + i * _KEY.size)
+            yield (unpack(key, self.size), *self._entry(i))
+
+    def _index(self, key: int) -> Optional[int]:
+        m = self._mmap
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k, = _KEY.unpack_from(m, self._keys + mid * _KEY.size)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def _entry(self, i: int) -> Tuple[rules.Direction, float]:
+        p, = _PROBABILITY.unpack_from(
+            self._mmap, self._probabilities + i * _PROBABILITY.size)
+        return _DIRECTIONS[self._mmap[self._directions + i]], p
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> 'Table':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def build(path: str, size: rules.Size, terminal_score: int) -> int:
+    """Enumerates all reachable states and writes the table of their exact
+    win probabilities.
+
+    Every turn adds one tile of 2 and moves keep the sum of the tiles, so
+    states of one turn all have the same sum. Values are therefore computed
+    turn by turn backwards, from the last turn to the first one.
+
+    :param path: Path of the file to write.
+    :param size: Size of the board.
+    :param terminal_score: Max score when the game ends. Must be a power of
+        two.
+    :returns: Number of stored states.
+    """
+
+    height, width = size
+    exponent = terminal_score.bit_length() - 1
+    if terminal_score != 2 ** exponent or exponent >= 16:
+        raise ValueError('Terminal score must be a power of two up to 2^15.')
+    if height * width > 16:
+        raise ValueError('Board must have at most 16 tiles.')
+    if state_bound(size, terminal_score) > MAX_STATES:
+        raise ValueError('Terminal score is too large for the board.')
+
+    moves = _Moves(size, exponent)
+
+    # Forward: enumerate states turn by turn.
+
+    turns: List[Dict[Tiles, None]] = []
+    turn = dict.fromkeys(_spawns((0,) * (height * width)))
+    while turn:
+        turns.append(turn)
+        following = {}
+        for state in turn:
+            if max(state) >= exponent:
+                continue
+            for _, moved in moves.apply(state):
+                following.update(dict.fromkeys(_spawns(moved)))
+        _log.info(f"Turn: {len(turns)}. States: {len(turn)}")
+        turn = following
+
+    # Backward: compute win probabilities from the last turn.
+
+    values: Dict[Tiles, float] = {}
+    table: Dict[int, Tuple[float, int]] = {}
+    for turn in reversed(turns):
+        current = {}
+        for state in turn:
+            if max(state) >= exponent:
+                current[state] = 1.
+                continue
+
+            best = None
+            for direction, moved in moves.apply(state):
+                children = list(_spawns(moved))
+                p = sum(values[c] for c in children) / len(children)
+                if best is None or p > best[0]:
+                    best = p, direction
+
+            if best is None:
+                current[state] = 0.
+            else:
+                current[state] = best[0]
+                table[pack(state)] = best[0], _DIRECTIONS.index(best[1])
+        values = current
+
+    keys = sorted(table)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER.pack(VERSION, height, width, exponent, len(keys)))
+        f.write(b''.join(_KEY.pack(k) for k in keys))
+        f.write(b''.join(_PROBABILITY.pack(table[k][0]) for k in keys))
+        f.write(bytes(table[k][1] for k in keys))
+
+    return len(keys)
+
+
+def state_bound(size: rules.Size, terminal_score: int) -> int:
+    """:returns: Upper bound of the number of states of the table, counting
+    all the boards with tiles below the terminal score."""
+
+    height, width = size
+    return terminal_score.bit_length() ** (height * width)
+
+
+def check(table: Table,
+          decide: Callable[[rules.Game2048], rules.Direction],
+          states: int) -> Tuple[int, int, float]:
+    """Compares decisions with the optimal ones from the table.
+
+    :param table: Table of the optimal decisions.
+    :param decide: Decision to check.
+    :param states: Number of states to check, evenly spaced in the table.
+    :returns: Number of checked states, number of optimal decisions and mean
+        loss of win probability.
+    """
+
+    moves = _Moves(table.size, table.terminal_score.bit_length() - 1)
+    step = max(1, table.count // states)
+
+    checked = optimal = 0
+    loss = 0.
+    for state, best, p in itertools.islice(table, 0, None, step):
+        game_ = to_game(state, table.size, table.terminal_score)
+        direction = decide(game_)
+
+        moved = dict(moves.apply(state))[direction]
+        children = list(_spawns(moved))
+        q = sum(table.probability(c) for c in children) / len(children)
+
+        checked += 1
+        optimal += q >= p
+        loss += p - q
+    return checked, optimal, loss / (checked or 1)
+
+
+# Board representation
+# -----------------------------------------------------------------------------
+
+def tiles(game_: rules.Game2048) -> Tiles:
+    height, width = game_.size
+    return tuple((game_.state[(i, j)] or 1).bit_length() - 1
+                 for i in range(height)
+                 for j in range(width))
+
+
+def to_game(state: Tiles,
+            size: rules.Size,
+            terminal_score: int) -> rules.Game2048:
+    height, width = size
+    return rules.Game2048.from_rows(
+        [[2 ** e if e else 0 for e in state[i * width:(i + 1) * width]]
+         for i in range(height)],
+        terminal_score=terminal_score)
+
+
+def pack(state: Tiles) -> int:
+    rv = 0
+    for i, e in enumerate(state):
+        rv |= e << (4 * i)
+    return rv
+
+
+def unpack(key: int, size: rules.Size) -> Tiles:
+    height, width = size
+    return tuple((key >> (4 * i)) & 0xf for i in range(height * width))
+
+
+def _spawns(state: Tiles) -> Iterator[Tiles]:
+    """:returns: States after MIN put a tile of 2 on each empty position."""
+
+    for i, e in enumerate(state):
+        if not e:
+            yield state[:i] + (1,) + state[i + 1:]
+
+
+class _Moves:
+    """Moves of MAX on boards represented as `Tiles`, computed row by row
+    from a table of all possible rows."""
+
+    def __init__(self, size: rules.Size, exponent: int):
+        height, width = size
+
+        # Indices of the tiles of each row (or column), ordered so that the
+        # tiles move towards the start.
+        rows = [[i * width + j for j in range(width)] for i in range(height)]
+        columns = [[i * width + j for i in range(height)]
+                   for j in range(width)]
+        self._lines = {
+            rules.Direction.UP: columns,
+            rules.Direction.RIGHT: [row[::-1] for row in rows],
+            rules.Direction.DOWN: [column[::-1] for column in columns],
+            rules.Direction.LEFT: rows,
+        }
+
+        lengths = {len(row) for rows in self._lines.values() for row in rows}
+        self._rows = {}
+        for length in lengths:
+            for row in itertools.product(range(exponent + 1), repeat=length):
+                self._rows[row] = _move_row(row)
+
+    def apply(self, state: Tiles) -> Iterator[Tuple[rules.Direction, Tiles]]:
+        """:returns: Applicable directions and the states after moving."""
+
+        rows = self._rows
+        for d, lines in self._lines.items():
+            rv = list(state)
+            for line in lines:
+                moved = rows[tuple(state[i] for i in line)]
+                for i, e in zip(line, moved):
+                    rv[i] = e
+            rv = tuple(rv)
+            if rv != state:
+                yield d, rv
+
+
+def _move_row(row: Tiles) -> Tiles:
+    """:returns: Row after moving its tiles towards its start."""
+
+    tiles_ = [e for e in row if e]
+    rv = []
+    i = 0
+    while i < len(tiles_):
+        if i + 1 < len(tiles_) and tiles_[i] == tiles_[i + 1]:
+            rv.append(tiles_[i] + 1)
+            i += 2
+        else:
+            rv.append(tiles_[i])
+            i += 1
+    return tuple(rv + [0] * (len(row) - len(rv)))
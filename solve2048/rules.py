@@ -1,7 +1,8 @@
 import enum
+import itertools
 import math
 import random
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import cache
 import game
@@ -13,11 +14,24 @@ Player = int
 Position = Tuple[int, int]
 Size = Position
 
+#: Max height and width of boards accepted by `Game2048.from_rows`.
+MAX_SIZE = 8
+
 #: Key is position of this tile on the board.
 #: Value is numerical value of the tile. None if the tile is empty.
 Board = Dict[Position, Optional[int]]
 
 
+#: Number of tile exponents covered by the Zobrist keys.
+_ZOBRIST_EXPONENTS = 2 * MAX_SIZE ** 2
+
+#: Zobrist key of MAX being the player to take action.
+_ZOBRIST_PLAYER = random.Random(-1).getrandbits(64)
+
+#: Entry of the tables of `Game2048.estimate`. See `Game2048._snake_row`.
+_SnakeRow = Tuple[float, float, bool, bool]
+
+
 class Direction(enum.Enum):
     """Direction in which to move all the tile on the board."""
 
@@ -37,35 +51,51 @@ class Game2048(game.Game[Board, Player]):
                  state: Board,
                  player: Player,
                  size: Size,
-                 terminal_score: int):
+                 terminal_score: int,
+                 zobrist: int = None):
         """
         :param state: Initial state.
         :param player: Player ID.
         :param size: Size of the board.
         :param terminal_score: Max score when the game ends.
+        :param zobrist: Zobrist hash of the state and the player, if already
+            known.
         """
 
         super().__init__(state, player)
         self.size = size
         self.terminal_score = terminal_score
 
-    def __hash__(self, *args, **kwargs):
-        rv = getattr(self, '__hashvalue', None)
-        if rv is None:
-            self.__hashvalue = rv = hash((tuple(self.state.items()),
-                                          self.player,
-                                          self.size,
-                                          self.terminal_score))
-            return rv
+        if zobrist is None:
+            keys = self._zobrist_keys(size)
+            zobrist = _ZOBRIST_PLAYER if player == +1 else 0
+            for pos, value in state.items():
+                if value is not None:
+                    zobrist ^= keys[pos][_exponent(value)]
+        self.zobrist = zobrist
+
+    def __hash__(self):
+        return self.zobrist
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Game2048):
+            return NotImplemented
+        return (self.zobrist == other.zobrist
+                and self.player == other.player
+                and self.size == other.size
+                and self.terminal_score == other.terminal_score
+                and self.state == other.state)
 
     # Heuristics
     # -------------------------------------------------------------------------
 
     # @cache.cached()
-    def terminal_test(self) -> bool:
+    def terminal_test(self, actions: List[Dict[str, Any]] = None) -> bool:
         if self.score() >= self.terminal_score:
             return True  # max wins
-        if not self.actions():
+        if not (self.actions() if actions is None else actions):
             return True  # min wins
         return False
 
@@ -111,6 +141,87 @@ class Game2048(game.Game[Board, Player]):
                 rv += s * w * d * (a + 1) * (b + 1)
         return rv
 
+    def estimate(self) -> float:
+        """Cheap alternative to `utility`: the same snake heuristic, summed
+        from tables of the pair terms of each row and column instead of
+        walking the board, and without calling `actions`. Won and lost games
+        are valued as by `utility`."""
+
+        height, width = self.size
+        state = self.state
+        exponents = [[(state[(i, j)] or 1).bit_length() - 1
+                      for j in range(width)]
+                     for i in range(height)]
+
+        if 2 ** max(map(max, exponents)) >= self.terminal_score:
+            return self.max_utility()
+
+        # The snake along the rows (see `_board_as_snake` to the right), and
+        # the one along the columns (down).
+
+        cells = height * width
+        rv = -math.inf
+        empty = movable = False
+        for lines in (exponents, list(zip(*exponents))):
+            length = len(lines[0])
+            table = self._snake_rows(length, cells)
+            v = 0.
+            last = None
+            for i, line in enumerate(lines):
+                line = tuple(line[::-1] if i % 2 else line)
+                try:
+                    a, b, e, m = table[line]
+                except KeyError:
+                    a, b, e, m = table[line] = self._snake_row(line, cells)
+
+                # Terms are weighted by their position on the snake.
+                start = i * length
+                v += (cells - start) * a - b
+                if last is not None:
+                    v += self._snake_term(last, line[0], cells - start + 1,
+                                          cells)
+                last = line[-1]
+                empty |= e
+                movable |= m
+            rv = max(rv, v)
+
+        if not empty and (self.player == -1 or not movable):
+            return self.min_utility()
+        return rv
+
+    @classmethod
+    @cache.cached(key=lambda cls, length, cells: (length, cells))
+    def _snake_rows(cls, length: int, cells: int
+                    ) -> Dict[Tuple[int, ...], _SnakeRow]:
+        """:returns: Table of rows of the length on a board of the number of
+        cells, filled by `estimate`."""
+
+        return {}
+
+    @classmethod
+    def _snake_row(cls, row: Tuple[int, ...], cells: int) -> _SnakeRow:
+        """:returns: Sums of the unweighted terms of `_utility` of the
+        neighbours in the row of tile exponents, and of those terms times
+        their offset in the row, whether the row has an empty tile, and
+        whether it has equal neighbours."""
+
+        a = b = 0.
+        merges = False
+        for k, (x, y) in enumerate(zip(row, row[1:])):
+            t = cls._snake_term(x, y, 1, cells)
+            a += t
+            b += k * t
+            merges |= x > 0 and x == y
+        return a, b, 0 in row, merges
+
+    @staticmethod
+    def _snake_term(a: int, b: int, w: int, maxlen: int) -> float:
+        """:returns: Term of `_utility` of the neighbours with the weight."""
+
+        s = +1 if a >= b else -1
+        d = maxlen - abs(1 - max(0.5, abs(a - b)))
+        return s * w * d * (a + 1) * (b + 1)
+
     def min_utility(self) -> float:
         return - self.max_utility()
 
@@ -131,7 +242,14 @@ class Game2048(game.Game[Board, Player]):
 
     @cache.cached()
     def actions(self) -> List[Dict[str, Any]]:
-        return super().actions()
+        # The actions are tested without the cache of `can_invoke`, as the
+        # list itself is cached.
+        if self.player == -1:
+            can_invoke = self._can_invoke_min
+        else:
+            can_invoke = self._can_invoke_max
+        return [kwargs for kwargs in self.all_actions()
+                if can_invoke(**kwargs)]
 
     # Can Invoke?
     # -------------------------------------------------------------------------
@@ -178,17 +296,21 @@ class Game2048(game.Game[Board, Player]):
     @cache.cached()
     def invoke(self, **kwargs) -> 'Game2048':
         if self.player == -1:
-            state = self._invoke_min(**kwargs)
+            state, zobrist = self._invoke_min(**kwargs)
         else:
             assert self.player == 1
-            state = self._invoke_max(**kwargs)
+            state, zobrist = self._invoke_max(**kwargs)
         return Game2048(state,
                         player=-self.player,
                         size=self.size,
-                        terminal_score=self.terminal_score)
+                        terminal_score=self.terminal_score,
+                        zobrist=zobrist ^ _ZOBRIST_PLAYER)
+
+    def _invoke_min(self, **kwargs) -> Tuple[Board, int]:
+        """:returns: New state and its Zobrist hash (without the player
+        switched)."""
 
-    def _invoke_min(self, **kwargs) -> Board:
-        if not self.can_invoke(**kwargs):
+        if not self._can_invoke_min(**kwargs):
             raise ValueError('kwargs')
 
         position: Position = kwargs['position']
@@ -196,25 +318,40 @@ class Game2048(game.Game[Board, Player]):
         # noinspection PyDictCreation
         state = {**self.state}
         state[position] = 2
-        return state
+        zobrist = self.zobrist ^ self._zobrist_keys(self.size)[position][1]
+        return state, zobrist
+
+    def _invoke_max(self, **kwargs) -> Tuple[Board, int]:
+        """:returns: New state and its Zobrist hash (without the player
+        switched)."""
 
-    def _invoke_max(self, **kwargs) -> Board:
-        if not self.can_invoke(**kwargs):
+        if not self._can_invoke_max(**kwargs):
             raise ValueError('kwargs')
 
         direction: Direction = kwargs['direction']
 
         state = {**self.state}
-        self._eliminate_empty_tiles(state, direction)
-        self._squash_equal_tiles(state, direction)
-        self._eliminate_empty_tiles(state, direction)
-        return state
+        changed = set()
+        self._eliminate_empty_tiles(state, direction, changed)
+        self._squash_equal_tiles(state, direction, changed)
+        self._eliminate_empty_tiles(state, direction, changed)
+
+        keys = self._zobrist_keys(self.size)
+        zobrist = self.zobrist
+        for pos in changed:
+            zobrist ^= (keys[pos][_exponent(self.state[pos])]
+                        ^ keys[pos][_exponent(state[pos])])
+        return state, zobrist
 
     def _eliminate_empty_tiles(self,
                                state: Board,
-                               direction: Direction) -> None:
+                               direction: Direction,
+                               changed: Set[Position]) -> None:
         """Move non-empty tile along the desired direction, while the empty
-        tiles vanish."""
+        tiles vanish.
+
+        :param changed: Positions of the changed tiles are added there.
+        """
 
         for row in self._rotate_board(self.size, direction):
             empty = []  # queue of visited empty tiles
@@ -228,11 +365,19 @@ class Game2048(game.Game[Board, Player]):
                     empty.append(pos)
                     state[empty_pos] = current
                     state[pos] = None
+                    changed.add(empty_pos)
+                    changed.add(pos)
 
-    def _squash_equal_tiles(self, state: Board, direction: Direction) -> None:
+    def _squash_equal_tiles(self,
+                            state: Board,
+                            direction: Direction,
+                            changed: Set[Position]) -> None:
         """Squashes two tiles of equal value into one tile, which is
         put on the position of the first tile, while the other tile is left
-        empty."""
+        empty.
+
+        :param changed: Positions of the changed tiles are added there.
+        """
 
         for row in self._rotate_board(self.size, direction):
             previous = None  # value of the last visited tile
@@ -243,10 +388,28 @@ class Game2048(game.Game[Board, Player]):
                 if current is not None and current == previous:
                     state[prev_pos] = previous * 2
                     state[pos] = current = None
+                    changed.add(prev_pos)
+                    changed.add(pos)
 
                 previous = current
                 prev_pos = pos
 
+    # Hashing
+    # -------------------------------------------------------------------------
+
+    @classmethod
+    @cache.cached(key=lambda cls, size: size)
+    def _zobrist_keys(cls, size: Size) -> Dict[Position, List[int]]:
+        """:returns: Random key for each position and tile exponent. Key of
+        the empty tile is 0."""
+
+        height, width = size
+        rng = random.Random(0)  # keep hashes stable between the runs
+        return {(i, j): [0, *(rng.getrandbits(64)
+                              for _ in range(1, _ZOBRIST_EXPONENTS))]
+                for i in range(height)
+                for j in range(width)}
+
     # Board Iterators
     # -------------------------------------------------------------------------
 
@@ -369,6 +532,64 @@ class Game2048(game.Game[Board, Player]):
         else:
             return "."
 
+    def to_rows(self) -> List[List[int]]:
+        """:returns: Tiles of the board row by row, 0 for empty tiles."""
+
+        height, width = self.size
+        return [[self.state[(i, j)] or 0 for j in range(width)]
+                for i in range(height)]
+
+    @classmethod
+    def from_rows(cls,
+                  rows: List[List[Optional[int]]],
+                  terminal_score: int,
+                  player: Player = +1,
+                  size: Size = None) -> 'Game2048':
+        """
+        :param rows: Tiles of the board row by row, 0 or None for empty tiles.
+        :param terminal_score: Max score when the game ends.
+        :param player: Player to take action.
+        :param size: Expected size of the board. Defaults to any size up to
+            `MAX_SIZE` tiles in either dimension.
+        :returns: Game in the given state.
+        :raises ValueError: If the rows do not describe a valid board.
+        """
+
+        if not isinstance(rows, list) or not rows:
+            raise ValueError('Board must be a non-empty list of rows.')
+        if not all(isinstance(row, list) for row in rows):
+            raise ValueError('Each row of the board must be a list.')
+
+        height = len(rows)
+        width = len(rows[0])
+        if not width or any(len(row) != width for row in rows):
+            raise ValueError('All rows of the board must have the same '
+                             'non-zero length.')
+        if size is not None and (height, width) != tuple(size):
+            raise ValueError(f'Board must be {size[0]}x{size[1]}, '
+                             f'got {height}x{width}.')
+        if height > MAX_SIZE or width > MAX_SIZE:
+            raise ValueError(f'Board must be at most {MAX_SIZE}x{MAX_SIZE}, '
+                             f'got {height}x{width}.')
+
+        state = {}
+        for i, row in enumerate(rows):
+            for j, value in enumerate(row):
+                if value is None:
+                    value = 0
+                if type(value) is not int:
+                    raise ValueError(f'Tile {(i, j)} must be an integer, '
+                                     f'got {value!r}.')
+                if value and (value < 2 or value & (value - 1)):
+                    raise ValueError(f'Tile {(i, j)} must be a power of two, '
+                                     f'got {value}.')
+                state[(i, j)] = value or None
+
+        return Game2048(state,
+                        player=player,
+                        size=(height, width),
+                        terminal_score=terminal_score)
+
     @classmethod
     def initialize(cls, **kwargs) -> 'Game2048':
         height, width = kwargs['size']  # size of the board
@@ -376,3 +597,9 @@ class Game2048(game.Game[Board, Player]):
         rv = Game2048(state, player=-1, **kwargs)
         rv = rv.invoke(**random.choice(rv.actions()))
         return rv
+
+
+def _exponent(value: Optional[int]) -> int:
+    """:returns: Exponent of the tile, 0 for the empty tile."""
+
+    return (value or 1).bit_length() - 1
@@ -1,11 +1,17 @@
+import array
+import inspect
 import logging
 import math
 import operator
 import random
-from typing import Any, Callable, Dict, List, Optional, Tuple
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import cache
 import game
+import record
+import rules
+import transposition
 
 T_Game = game.Game[Any, int]
 Action = Dict[str, Any]
@@ -13,16 +19,64 @@ Action = Dict[str, Any]
 _log = logging.getLogger()
 
 
+class SearchCancelled(Exception):
+    """Search was stopped before it finished."""
+
+
 # Expectimax
 # -----------------------------------------------------------------------------
 
-@cache.cached()
 def expectimax_decision(game_: T_Game,
                         depth: int = -1,
                         alpha=-math.inf,
                         beta=+math.inf,
-                        maxdepth: int = None) -> Action:
+                        maxdepth: int = None,
+                        iterative: bool = False,
+                        layered: bool = False,
+                        full_depth: int = None) -> Action:
+    rv, _ = expectimax_analysis(game_, depth, alpha, beta, maxdepth,
+                                iterative=iterative,
+                                layered=layered,
+                                full_depth=full_depth)
+    return rv
+
+
+def _analysiskey(*args, cancelled: Callable[[], bool] = None, **kwargs):
+    """:returns: Cache key of `expectimax_analysis`. A finished search does
+    not depend on its cancel hook, so the hook is not a part of the key."""
+
+    return cache.cachekey(*args, **kwargs)
+
+
+@cache.cached(key=_analysiskey)
+def expectimax_analysis(game_: T_Game,
+                        depth: int = -1,
+                        alpha=-math.inf,
+                        beta=+math.inf,
+                        maxdepth: int = None,
+                        iterative: bool = False,
+                        layered: bool = False,
+                        full_depth: int = None,
+                        cancelled: Callable[[], bool] = None
+                        ) -> Tuple[Action, List[Tuple[Action, float]]]:
+    """Same as `expectimax_decision`, but also returns the utilities of the
+    root actions from the deepest search that was made.
+
+    :param iterative: Evaluate the plies with `expectimax_value` instead of
+        the recursive functions.
+    :param layered: Evaluate the plies of all the actions together with
+        `layered_expectimax_values`.
+    :param full_depth: Evaluate leaves deeper than this number of plies with
+        the cheap `estimate` instead of the full `utility`. None for `utility`
+        at any depth.
+    :param cancelled: See `expectimax_value`. Requires `iterative`.
+    """
+
+    if cancelled is not None and not iterative:
+        raise ValueError('Only the iterative search can be cancelled.')
+
     maxdepth = maxdepth if maxdepth is not None else depth / 2
+    cheap = full_depth is not None and (depth < 0 or depth > full_depth)
 
     try:
         actions = game_.actions()
@@ -30,14 +84,27 @@ def expectimax_decision(game_: T_Game,
             raise StopIteration()
 
         if game_.player == -1:
-            return random.choice(actions)
+            return random.choice(actions), []
         else:
             assert game_.player == +1
 
+            plies = [game_.invoke(**a) for a in actions]
+            if layered:
+                values, _ = layered_expectimax_values(plies,
+                                                      depth=depth,
+                                                      cheap=cheap)
+            elif iterative:
+                values = [expectimax_value(p,
+                                           depth=depth,
+                                           cheap=cheap,
+                                           cancelled=cancelled)
+                          for p in plies]
+            else:
+                values = [_expectimax_chance_value(p, depth=depth, cheap=cheap)
+                          for p in plies]
+
             utilities = []
-            for a in actions:
-                ply = game_.invoke(**a)
-                v = _expectimax_chance_value(ply, depth=depth)
+            for a, v in zip(actions, values):
                 _log.debug(f"{a}\t"
                            f"Utility: {v:.2f}\t"
                            f"Depth: {depth}\t"
@@ -51,53 +118,633 @@ def expectimax_decision(game_: T_Game,
 
             rv = _best_utility(utilities, operator.gt)
             if rv is not None:
-                return rv
+                return rv, utilities
             a, v = utilities[0]
             if v <= alpha or v >= beta:
-                return a
+                return a, utilities
 
             if depth < 0 or maxdepth < 0:
-                return a
+                return a, utilities
 
-            return expectimax_decision(game_,
+            return expectimax_analysis(game_,
                                        depth + 1,
                                        alpha,
                                        beta,
-                                       maxdepth - 1)
+                                       maxdepth - 1,
+                                       iterative=iterative,
+                                       layered=layered,
+                                       full_depth=full_depth,
+                                       cancelled=cancelled)
     finally:
         _log.debug(cache.get_stats())
         # cache.reset_stats(module='rules')
 
 
-@cache.cached()
-def _expectimax_max_value(game_: T_Game, depth: int = -1) -> float:
+def _valuekey(game_: T_Game, depth: int = -1, cheap: bool = False):
+    """:returns: Cache key of the value functions. Values with the full
+    `utility` are keyed by the game and the depth only."""
+
+    if cheap:
+        return cache.cachekey(game_, depth=depth, cheap=True)
+    return cache.cachekey(game_, depth=depth)
+
+
+def _leaf_value(game_: T_Game, cheap: bool) -> float:
+    return game_.estimate() if cheap else game_.utility()
+
+
+@cache.cached(key=_valuekey)
+@transposition.shared
+def _expectimax_max_value(game_: T_Game,
+                          depth: int = -1,
+                          cheap: bool = False) -> float:
     assert game_.player == +1
 
-    if game_.terminal_test() or depth == 0:
-        return game_.utility()
+    if depth == 0 or game_.terminal_test():
+        return _leaf_value(game_, cheap)
 
     rv = -math.inf
     for a in game_.actions():
         ply = game_.invoke(**a)
-        rv = max(rv, _expectimax_chance_value(ply, depth=depth - 1))
+        rv = max(rv, _expectimax_chance_value(ply,
+                                              depth=depth - 1,
+                                              cheap=cheap))
     return rv
 
 
-@cache.cached()
-def _expectimax_chance_value(game_: T_Game, depth: int = -1) -> float:
+@cache.cached(key=_valuekey)
+@transposition.shared
+def _expectimax_chance_value(game_: T_Game,
+                             depth: int = -1,
+                             cheap: bool = False) -> float:
     assert game_.player == -1
 
-    if game_.terminal_test() or depth == 0:
-        return game_.utility()
+    if depth == 0 or game_.terminal_test():
+        return _leaf_value(game_, cheap)
 
     rv = 0
     actions = game_.actions()
     for a in actions:
         ply = game_.invoke(**a)
-        rv += _expectimax_max_value(ply, depth=depth - 1)
+        rv += _expectimax_max_value(ply, depth=depth - 1, cheap=cheap)
     return rv / len(actions)
 
 
+def expectimax_value(game_: T_Game,
+                     depth: int = -1,
+                     cheap: bool = False,
+                     cancelled: Callable[[], bool] = None) -> float:
+    """Same as `_expectimax_max_value` and `_expectimax_chance_value` (chosen
+    by the player of the game), but walks the tree with an explicit stack
+    instead of recursion. Shares the caches and the transposition table with
+    the recursive functions.
+
+    :param cheap: Evaluate the leaves with the cheap `estimate` instead of
+        the full `utility`.
+    :param cancelled: Checked before each node is expanded. When it returns
+        True, the search stops with `SearchCancelled`. Values of the nodes
+        searched so far stay in the caches.
+    """
+
+    # Values of the cheap evaluation are not stored in the table.
+    table = transposition.table if not cheap else None
+
+    # The caches are looked up directly rather than through the decorated
+    # functions and methods, to save the calls in the inner loop. The keys
+    # are the same as those of the decorators.
+    cachekey = cache.cachekey
+    max_cache = cache.get_cache(__name__, '_expectimax_max_value')
+    chance_cache = cache.get_cache(__name__, '_expectimax_chance_value')
+    module = type(game_).__module__
+    actions_cache = cache.get_cache(module, 'actions')
+    invoke_cache = cache.get_cache(module, 'invoke')
+    actions_of = inspect.unwrap(type(game_).actions)
+    invoke = inspect.unwrap(type(game_).invoke)
+
+    # Each frame is [game, depth, actions, index of the next action,
+    # accumulated value, cache key]. Frames are preallocated for the whole
+    # depth and reused as the search goes up and down.
+
+    frames = [[None] * 6 for _ in range(max(depth, 0) + 1)]
+    top = -1
+
+    # Value of the node resolved last, which is to be merged into the frame
+    # on the top of the stack.
+    value = None
+
+    node, node_depth = game_, depth
+    while True:
+        if node is not None:
+            if cancelled is not None and cancelled():
+                raise SearchCancelled()
+
+            # Try to resolve the node without expanding it.
+
+            c = max_cache if node.player == +1 else chance_cache
+            if cheap:
+                key = cachekey(node, depth=node_depth, cheap=True)
+            else:
+                key = cachekey(node, depth=node_depth)
+            try:
+                value = c[key] if c is not None else None
+            except KeyError:
+                value = None
+
+            if value is None and table is not None:
+                value = table.probe(node, node_depth)
+                if value is not None and c is not None:
+                    c[key] = value
+
+            if value is None:
+                actions = None
+                if node_depth == 0:
+                    pass
+                elif actions_cache is None:
+                    actions = actions_of(node)
+                else:
+                    k = cachekey(node)
+                    try:
+                        actions = actions_cache[k]
+                    except KeyError:
+                        actions = actions_cache[k] = actions_of(node)
+
+                if node_depth == 0 or node.terminal_test(actions):
+                    value = _leaf_value(node, cheap)
+                    if c is not None:
+                        c[key] = value
+                    if table is not None:
+                        table.store(node, node_depth, value)
+                else:
+                    top += 1
+                    if top == len(frames):
+                        frames.append([None] * 6)
+                    frame = frames[top]
+                    frame[0] = node
+                    frame[1] = node_depth
+                    frame[2] = actions
+                    frame[3] = 0
+                    frame[4] = -math.inf if node.player == +1 else 0
+                    frame[5] = key
+            node = None
+
+        if top < 0:
+            return value
+
+        frame = frames[top]
+        if value is not None:
+            if frame[0].player == +1:
+                if value > frame[4]:
+                    frame[4] = value
+            else:
+                frame[4] += value
+            value = None
+
+        actions = frame[2]
+        if frame[3] < len(actions):
+            a = actions[frame[3]]
+            if invoke_cache is None:
+                node = invoke(frame[0], **a)
+            else:
+                k = cachekey(frame[0], **a)
+                try:
+                    node = invoke_cache[k]
+                except KeyError:
+                    node = invoke_cache[k] = invoke(frame[0], **a)
+            node_depth = frame[1] - 1
+            frame[3] += 1
+            continue
+
+        # All children were visited. Finish the frame and pass its value to
+        # the parent.
+
+        if frame[0].player == +1:
+            value = frame[4]
+            c = max_cache
+        else:
+            value = frame[4] / len(actions)
+            c = chance_cache
+        if c is not None:
+            c[frame[5]] = value
+        if table is not None:
+            table.store(frame[0], frame[1], value)
+
+        frame[0] = frame[2] = None
+        top -= 1
+        if top < 0:
+            return value
+
+
+def benchmark_evaluation(games: List[T_Game],
+                         depth: int,
+                         full_depth: int) -> Dict[str, float]:
+    """Searches each game with the full `utility` at all leaves, and with
+    the cheap `estimate` at leaves deeper than `full_depth`. Each of the two
+    searches goes through the games in order, from cold caches which are
+    then kept, as when a game is played.
+
+    :returns: Number of searched positions, wall time per decision and
+        searched nodes per second of both searches, and the share of
+        positions where both searches chose the same action.
+    """
+
+    full, full_nodes, full_elapsed = _benchmark(games, depth, None)
+    tiered, tiered_nodes, tiered_elapsed = _benchmark(games, depth, full_depth)
+    positions = len(games) or 1
+    return dict(
+        positions=len(games),
+        full_seconds_per_decision=full_elapsed / positions,
+        tiered_seconds_per_decision=tiered_elapsed / positions,
+        full_nodes_per_second=full_nodes / (full_elapsed or 0.001),
+        tiered_nodes_per_second=tiered_nodes / (tiered_elapsed or 0.001),
+        agreement=sum(a == b for a, b in zip(full, tiered)) / positions)
+
+
+def _benchmark(games: List[T_Game],
+               depth: int,
+               full_depth: Optional[int]
+               ) -> Tuple[List[Optional[Action]], int, float]:
+    """:returns: Decisions, number of searched nodes and elapsed time."""
+
+    caches = [cache.get_cache(__name__, '_expectimax_max_value'),
+              cache.get_cache(__name__, '_expectimax_chance_value')]
+    if None in caches:
+        raise ValueError('Benchmark requires caching.')
+
+    cache.clear()
+    cache.reset_stats()
+
+    actions = []
+    elapsed = 0.
+    for game_ in games:
+        start = time.perf_counter()
+        try:
+            action = expectimax_decision(game_,
+                                         depth=depth,
+                                         alpha=game_.min_utility(),
+                                         beta=game_.max_utility(),
+                                         full_depth=full_depth)
+        except StopIteration:
+            action = None
+        elapsed += time.perf_counter() - start
+        actions.append(action)
+
+    nodes = sum(c.miss for c in caches)
+    cache.clear()
+    return actions, nodes, elapsed
+
+
+# Node Budget
+# -----------------------------------------------------------------------------
+
+def estimate_nodes(game_: T_Game, depth: int) -> int:
+    """:returns: Estimated number of nodes `expectimax_value` visits to
+    search all the actions of MAX to the depth. Each spawn is assumed to fill
+    one empty tile, and the number of applicable actions of MAX to stay the
+    same."""
+
+    empty = sum(1 for v in game_.state.values() if v is None)
+    moves = len(game_.actions())
+
+    rv = width = moves
+    spawns = 0
+    for ply in range(depth):
+        if ply % 2 == 0:
+            width *= max(1, empty - spawns)
+            spawns += 1
+        else:
+            width *= moves
+        rv += width
+    return rv
+
+
+def budget_depth(game_: T_Game, budget: int, max_depth: int) -> int:
+    """:returns: Deepest depth up to `max_depth` which is estimated to fit
+    in the budget of nodes, 0 if none does."""
+
+    rv = 0
+    for depth in range(1, max_depth + 1):
+        if estimate_nodes(game_, depth) > budget:
+            break
+        rv = depth
+    return rv
+
+
+def budgeted_expectimax_analysis(
+        game_: T_Game,
+        budget: int,
+        max_depth: int,
+        full_depth: int = None
+) -> Tuple[Action, List[Tuple[Action, float]], int, int]:
+    """Searches for the best action of MAX as deep as the budget of nodes
+    allows.
+
+    The depth is chosen by `budget_depth`. If the search visits more nodes
+    than the budget, it is abandoned and repeated one ply shallower. Nodes
+    are counted rather than timed, so the decisions are the same on any
+    machine.
+
+    :param budget: Max number of nodes visited by the search.
+    :param max_depth: Max search depth.
+    :param full_depth: See `expectimax_analysis`.
+    :returns: Best action, the utilities of the actions, the depth of the
+        search and the number of abandoned searches.
+    :raises StopIteration: MAX has no applicable action.
+    """
+
+    actions = game_.actions()
+    if not actions:
+        raise StopIteration()
+
+    depth = budget_depth(game_, budget, max_depth)
+    aborted = 0
+    while True:
+        cheap = full_depth is not None and depth > full_depth
+        visited = 0
+
+        def cancelled():
+            nonlocal visited
+            visited += 1
+            return depth > 0 and visited > budget
+
+        try:
+            utilities = [(a, expectimax_value(game_.invoke(**a),
+                                              depth=depth,
+                                              cheap=cheap,
+                                              cancelled=cancelled))
+                         for a in actions]
+        except SearchCancelled:
+            _log.info(f"Depth: {depth}. Over budget, searching shallower.")
+            aborted += 1
+            depth -= 1
+            continue
+
+        rv = _best_utility(utilities, operator.gt)
+        if rv is None:
+            rv = max(utilities, key=operator.itemgetter(1))[0]
+        return rv, utilities, depth, aborted
+
+
+# Level-synchronous Expectimax
+# -----------------------------------------------------------------------------
+
+class LayerStats:
+    def __init__(self, ply: int, generated: int, unique: int, leaves: int):
+        self.ply = ply
+        self.generated = generated
+        self.unique = unique
+        self.leaves = leaves
+
+    def dedup_ratio(self) -> float:
+        """:returns: Generated positions per unique position."""
+
+        return self.generated / (self.unique or 1)
+
+    def __str__(self):
+        return (f"Ply: {self.ply}. "
+                f"Generated: {self.generated}. "
+                f"Unique: {self.unique}. "
+                f"Leaves: {self.leaves}. "
+                f"Dedup ratio: {self.dedup_ratio():.2f}")
+
+
+class _Layer:
+    """Unique positions of one ply, with their boards packed one after
+    another (see `record.pack_board`), and an index map into the next ply:
+    children of the i-th position are `children[offsets[i]:offsets[i + 1]]`.
+    Positions without children are leaves, evaluated when the ply is
+    expanded.
+
+    Only the packed boards are kept. Games are unpacked from them one at a
+    time, when the ply is expanded."""
+
+    def __init__(self, player: int, size: rules.Size, terminal_score: int):
+        self.player = player
+        self.size = size
+        self.terminal_score = terminal_score
+        self.boards = bytearray()
+        self.index: Dict[bytes, int] = {}
+        self.offsets = array.array('Q', [0])
+        self.children = array.array('Q')
+        self.values = array.array('d')
+
+    def __len__(self):
+        return len(self.boards) // (self.size[0] * self.size[1])
+
+    def add(self, game_: rules.Game2048) -> int:
+        """:returns: Index of the position, added if it is new."""
+
+        board = record.pack_board(game_.state, self.size)
+        rv = self.index.get(board)
+        if rv is None:
+            rv = self.index[board] = len(self.index)
+            self.boards += board
+        return rv
+
+    def games(self) -> Iterator[rules.Game2048]:
+        """:returns: Positions in order of their indices."""
+
+        n = self.size[0] * self.size[1]
+        for i in range(0, len(self.boards), n):
+            yield rules.Game2048(
+                record.unpack_board(self.boards[i:i + n], self.size),
+                player=self.player,
+                size=self.size,
+                terminal_score=self.terminal_score)
+
+
+def layered_expectimax_values(games: List[T_Game],
+                              depth: int = -1,
+                              cheap: bool = False
+                              ) -> Tuple[List[float], List[LayerStats]]:
+    """Same as `expectimax_value` for each of the games, but expands their
+    trees together breadth-first, one ply at a time. A position reached
+    several times within a ply, e.g. through spawns in a different order, is
+    expanded and evaluated only once. Values are then backed up from the
+    last ply to the first one through the index maps of the plies.
+
+    Does not use the caches of the recursive functions, and yields the same
+    values.
+
+    :param games: Games with the same player to move.
+    :param cheap: Evaluate the leaves with the cheap `estimate` instead of
+        the full `utility`.
+    :returns: Values of the games and statistics of the plies.
+    """
+
+    if not games:
+        return [], []
+    assert all(g.player == games[0].player for g in games)
+
+    layer = _Layer(games[0].player, games[0].size, games[0].terminal_score)
+    roots = [layer.add(g) for g in games]
+    layers = []
+    stats = []
+    generated = len(games)
+    remaining = depth
+
+    # Forward: expand the plies, deduplicating the positions of each ply.
+
+    while len(layer):
+        following = _Layer(-layer.player, layer.size, layer.terminal_score)
+        leaves = 0
+        for game_ in layer.games():
+            if remaining == 0 or game_.terminal_test():
+                layer.values.append(_leaf_value(game_, cheap))
+                leaves += 1
+            else:
+                layer.values.append(math.nan)
+                for a in game_.actions():
+                    layer.children.append(following.add(game_.invoke(**a)))
+            layer.offsets.append(len(layer.children))
+
+        stats.append(LayerStats(len(layers), generated, len(layer), leaves))
+        _log.info(stats[-1])
+        generated = len(layer.children)
+
+        layer.index = {}
+        layers.append(layer)
+        layer = following
+        remaining -= 1
+
+    # Backward: back the values up from the children.
+
+    following = None
+    for layer in reversed(layers):
+        values = layer.values
+        offsets = layer.offsets
+        children = layer.children
+        for i in range(len(values)):
+            start, end = offsets[i], offsets[i + 1]
+            if start == end:
+                continue
+
+            if layer.player == +1:
+                rv = -math.inf
+                for j in range(start, end):
+                    rv = max(rv, following.values[children[j]])
+            else:
+                rv = 0
+                for j in range(start, end):
+                    rv += following.values[children[j]]
+                rv /= end - start
+            values[i] = rv
+        following = layer
+
+    return [layers[0].values[i] for i in roots], stats
+
+
+# Sampled Expectimax
+# -----------------------------------------------------------------------------
+
+def sampled_expectimax_analysis(
+        game_: T_Game,
+        depth: int,
+        samples: Tuple[int, ...],
+        seed: int = 0) -> Tuple[Action, List[Tuple[Action, float, float]]]:
+    """Expectimax, which evaluates at most K children of each chance node.
+
+    Children of a chance node are split into K contiguous strata and one
+    child is drawn from each stratum, weighted by the size of the stratum.
+    The draws are seeded by the state, so the search is deterministic.
+
+    :param game_: Game, where it's MAX's turn.
+    :param depth: Number of steps to look forward.
+    :param samples: K for the chance nodes at each ply from the root. The
+        last value applies to all deeper plies. 0 to evaluate all children.
+    :param seed: Random seed of the sampling.
+    :returns: Best action and the utilities of the root actions with the
+        estimated standard error of the sampling.
+    """
+
+    actions = game_.actions()
+    if not actions:
+        raise StopIteration()
+    assert game_.player == +1
+
+    utilities = []
+    for a in actions:
+        ply = game_.invoke(**a)
+        v, variance = _sampled_chance_value(ply, depth, tuple(samples), seed)
+        _log.debug(f"{a}\t"
+                   f"Utility: {v:.2f}\t"
+                   f"Error: {math.sqrt(variance):.2f}\t"
+                   f"Depth: {depth}\t")
+        utilities.append((a, v, math.sqrt(variance)))
+
+    rv = _best_utility([(a, v) for a, v, _ in utilities], operator.gt)
+    if rv is None:
+        rv = max(utilities, key=operator.itemgetter(1))[0]
+    return rv, utilities
+
+
+@cache.cached()
+def _sampled_max_value(game_: T_Game,
+                       depth: int,
+                       samples: Tuple[int, ...],
+                       seed: int) -> Tuple[float, float]:
+    """:returns: Utility and variance of its estimate."""
+
+    assert game_.player == +1
+
+    if game_.terminal_test() or depth == 0:
+        return game_.utility(), 0.
+
+    rv = -math.inf, 0.
+    for a in game_.actions():
+        ply = game_.invoke(**a)
+        v = _sampled_chance_value(ply, depth - 1, samples, seed)
+        if v[0] > rv[0]:
+            rv = v
+    return rv
+
+
+@cache.cached()
+def _sampled_chance_value(game_: T_Game,
+                          depth: int,
+                          samples: Tuple[int, ...],
+                          seed: int) -> Tuple[float, float]:
+    """:returns: Utility and variance of its estimate."""
+
+    assert game_.player == -1
+
+    if game_.terminal_test() or depth == 0:
+        return game_.utility(), 0.
+
+    k, deeper = samples[0], samples[1:] or samples
+    actions = game_.actions()
+    n = len(actions)
+
+    if not k or k >= n:
+        rv = variance = 0.
+        for a in actions:
+            v, e = _sampled_max_value(game_.invoke(**a), depth - 1, deeper,
+                                      seed)
+            rv += v
+            variance += e
+        return rv / n, variance / n ** 2
+
+    rng = random.Random(repr((sorted(game_.state.items()), depth, seed)))
+
+    rv = variance = 0.
+    values = []
+    for i in range(k):
+        start, stop = n * i // k, n * (i + 1) // k
+        a = actions[rng.randrange(start, stop)]
+        w = (stop - start) / n
+        v, e = _sampled_max_value(game_.invoke(**a), depth - 1, deeper, seed)
+        rv += w * v
+        variance += w ** 2 * e
+        values.append(v)
+
+    # Estimate variance of the sampling as if the samples were drawn at
+    # random, with the finite population correction. A single sample gives
+    # no estimate.
+    mean = sum(values) / k
+    s2 = sum((v - mean) ** 2 for v in values) / (k - 1) if k > 1 else 0.
+    variance += (1 - k / n) * s2 / k
+    return rv, variance
+
+
 # Minimax
 # -----------------------------------------------------------------------------
 
@@ -0,0 +1,176 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import analysis
+import rules
+import transposition
+import utils
+
+_log = logging.getLogger()
+
+
+class SolverServer:
+    """Answers best moves for boards sent over a UNIX socket.
+
+    Each line received from a client is a JSON request, which is answered by
+    exactly one line with a JSON response. Requests are:
+
+    - `{"board": [[2, 0, ...], ...], "depth": 5, "score": 2048}` - searches
+      for the best direction. `depth` and `score` are optional. The board
+      must have the size the server was configured with.
+    - `{"stats": true}` - returns the server statistics.
+
+    Searches run in a pool of long-lived processes, so that each worker keeps
+    its caches warm between requests.
+    """
+
+    def __init__(self,
+                 workers: int,
+                 size: Tuple[int, int],
+                 depth: int,
+                 score: int,
+                 seed: int = 0,
+                 cache_size: int = None,
+                 table: transposition.SharedTable = None):
+        """
+        :param workers: Number of worker processes.
+        :param size: Size of the boards to accept.
+        :param depth: Default search depth.
+        :param score: Default terminal score.
+        :param seed: Random seed of the workers.
+        :param cache_size: Cache size of the workers. (Actual cache size is
+            2 ** cache_size)
+        :param table: Transposition table shared by the workers.
+        """
+
+        self.workers = workers
+        self.size = size
+        self.depth = depth
+        self.score = score
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            workers,
+            initializer=utils.init_worker,
+            initargs=(seed,
+                      cache_size,
+                      (table.name, table.lock) if table else None))
+        self.table = table
+
+        self.pending = 0
+        self.served = 0
+        self.failed = 0
+        self.latencies = collections.deque(maxlen=1000)
+
+    async def handle(self,
+                     reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.request(line)
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def request(self, line: bytes) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            request = json.loads(line)
+            if request.get('stats'):
+                return self.stats()
+
+            board = request['board']
+            depth = int(request.get('depth', self.depth))
+            score = int(request.get('score', self.score))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.failed += 1
+            return dict(error=f"Invalid request: {e!r}")
+
+        try:
+            rules.Game2048.from_rows(board,
+                                     terminal_score=score,
+                                     size=self.size)
+        except ValueError as e:
+            self.failed += 1
+            return dict(error=f"Invalid board: {e}")
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            rv = await loop.run_in_executor(
+                self._executor, analysis.analyze_board, board, depth, score)
+        except (ValueError, TypeError) as e:
+            self.failed += 1
+            return dict(error=f"Invalid board: {e!r}")
+        finally:
+            self.pending -= 1
+
+        latency = time.perf_counter() - start
+        self.latencies.append(latency)
+        self.served += 1
+        _log.info(f"Direction: {rv['direction']}. "
+                  f"Latency: {latency:.6f}. "
+                  f"Queue depth: {self.queue_depth()}")
+
+        rv['latency'] = latency
+        return rv
+
+    def queue_depth(self) -> int:
+        """:returns: Number of searches waiting for a free worker."""
+
+        return max(0, self.pending - self.workers)
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not count:
+                return None
+            return latencies[min(count - 1, int(count * p))]
+
+        rv = dict(served=self.served,
+                  failed=self.failed,
+                  pending=self.pending,
+                  queue_depth=self.queue_depth(),
+                  latency_mean=sum(latencies) / count if count else None,
+                  latency_p50=percentile(0.5),
+                  latency_p95=percentile(0.95),
+                  latency_max=latencies[-1] if count else None)
+        if self.table:
+            rv['transposition'] = self.table.get_stats().splitlines()
+        return rv
+
+    async def serve_forever(self, path: str) -> None:
+        server = await asyncio.start_unix_server(self.handle, path=path)
+        _log.warning(f"Listening on {path} with {self.workers} workers.")
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+def serve(path: str, **kwargs) -> None:
+    """Runs the server until interrupted.
+
+    :param path: Path of the UNIX socket to listen on.
+    :param kwargs: See `SolverServer`.
+    """
+
+    server = SolverServer(**kwargs)
+    try:
+        asyncio.run(server.serve_forever(path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -0,0 +1,249 @@
+import functools
+import multiprocessing
+import os
+import struct
+from multiprocessing import shared_memory
+from typing import Any, Callable, List, Optional, Tuple
+
+import record
+import rules
+import utils
+
+#: Shared memory starts with the magic, followed by the header (version,
+#: height, width, terminal score, number of records and number of statistics
+#: slots), the statistics slots (one per attached process) and the records.
+#:
+#: Record: check, Zobrist hash, depth, value and the exponents of the tiles
+#: (one byte per tile). The check is the Zobrist hash XOR-ed with the depth
+#: and the value, so that a record torn by two processes writing at once is
+#: detected and treated as a miss.
+MAGIC = b'S2048TT\0'
+VERSION = 1
+
+_HEADER = struct.Struct('<BBBxQQII')
+_SLOT = struct.Struct('<QQQQ')  # pid, probes, hits, stores
+_RECORD = struct.Struct('<QQid')
+
+_MASK = 2 ** 64 - 1
+
+#: Table the current process is attached to.
+table: Optional['SharedTable'] = None
+
+
+class SharedTable:
+    """Fixed-size transposition table in shared memory.
+
+    Records are grouped into buckets of two. The first record of a bucket is
+    replaced only by a search of the same or greater depth, the second one
+    always. Values are returned only for the same state and depth, so the
+    searches return the same values with or without the table.
+    """
+
+    def __init__(self,
+                 size: rules.Size,
+                 terminal_score: int,
+                 capacity: int,
+                 processes: int):
+        """Creates a new table.
+
+        :param size: Size of the board.
+        :param terminal_score: Max score when the game ends.
+        :param capacity: Number of records.
+        :param processes: Max number of attached processes.
+        """
+
+        height, width = size
+        capacity += capacity % 2
+        length = (len(MAGIC)
+                  + _HEADER.size
+                  + processes * _SLOT.size
+                  + capacity * (_RECORD.size + height * width))
+
+        self._shm = shared_memory.SharedMemory(create=True, size=length)
+        self._shm.buf[:len(MAGIC)] = MAGIC
+        _HEADER.pack_into(self._shm.buf, len(MAGIC), VERSION, height, width,
+                          terminal_score, capacity, processes, 0)
+        self._owner = True
+        self._lock = multiprocessing.Lock()
+        self._init()
+
+    @classmethod
+    def attach(cls, name: str, lock: Any) -> 'SharedTable':
+        """Attaches to a table created by another process.
+
+        :param name: Name of the table.
+        :param lock: Lock of the table.
+        """
+
+        rv = cls.__new__(cls)
+        rv._shm = shared_memory.SharedMemory(name=name)
+        rv._owner = False
+        rv._lock = lock
+        if bytes(rv._shm.buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError('Not a transposition table.')
+        rv._init()
+        return rv
+
+    def _init(self) -> None:
+        buf = self._shm.buf
+        version, height, width, terminal_score, capacity, processes, _ = \
+            _HEADER.unpack_from(buf, len(MAGIC))
+        if version != VERSION:
+            raise ValueError(f'Unsupported transposition table version: '
+                             f'{version}.')
+
+        self.size = (height, width)
+        self.terminal_score = terminal_score
+        self.capacity = capacity
+        self.processes = processes
+
+        self._slots = len(MAGIC) + _HEADER.size
+        self._records = self._slots + processes * _SLOT.size
+        self._record_size = _RECORD.size + height * width
+        self._slot = None
+
+        self.probes = self.hits = self.stores = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def lock(self) -> Any:
+        return self._lock
+
+    # Probing
+    # -------------------------------------------------------------------------
+
+    def probe(self, game_: rules.Game2048, depth: int) -> Optional[float]:
+        """:returns: Value of the state searched to the depth, None if it is
+        not in the table."""
+
+        self.probes += 1
+        if not self._matches(game_):
+            return None
+
+        buf = self._shm.buf
+        board = record.pack_board(game_.state, game_.size)
+        zobrist = game_.zobrist & _MASK
+        for offset in self._bucket(zobrist):
+            check, z, d, v = _RECORD.unpack_from(buf, offset)
+            if z != zobrist or d != depth:
+                continue
+            if check != _check(z, d, v):
+                continue
+            if buf[offset + _RECORD.size:offset + self._record_size] != board:
+                continue
+            self.hits += 1
+            return v
+        return None
+
+    def store(self, game_: rules.Game2048, depth: int, value: float) -> None:
+        if not self._matches(game_):
+            return
+
+        buf = self._shm.buf
+        zobrist = game_.zobrist & _MASK
+        first, second = self._bucket(zobrist)
+        _, z, d, _ = _RECORD.unpack_from(buf, first)
+        offset = first if z == zobrist or depth >= d else second
+
+        _RECORD.pack_into(buf, offset,
+                          _check(zobrist, depth, value), zobrist, depth, value)
+        buf[offset + _RECORD.size:offset + self._record_size] = \
+            record.pack_board(game_.state, game_.size)
+        self.stores += 1
+
+    def _bucket(self, zobrist: int) -> Tuple[int, int]:
+        first = (zobrist % (self.capacity // 2)) * 2
+        offset = self._records + first * self._record_size
+        return offset, offset + self._record_size
+
+    def _matches(self, game_: rules.Game2048) -> bool:
+        return (game_.size == self.size
+                and game_.terminal_score == self.terminal_score)
+
+    # Statistics
+    # -------------------------------------------------------------------------
+
+    def publish_stats(self) -> None:
+        """Writes statistics of this process to its slot in the table."""
+
+        if self._slot is None:
+            with self._lock:
+                buf = self._shm.buf
+                header = list(_HEADER.unpack_from(buf, len(MAGIC)))
+                if header[-1] >= self.processes:
+                    return  # no free slot
+                self._slot = header[-1]
+                header[-1] += 1
+                _HEADER.pack_into(buf, len(MAGIC), *header)
+
+        _SLOT.pack_into(self._shm.buf, self._slots + self._slot * _SLOT.size,
+                        os.getpid(), self.probes, self.hits, self.stores)
+
+    def get_stats(self) -> str:
+        """:returns: Hit rates of the attached processes and the global hit
+        rate."""
+
+        rows = []
+        total = [0, 0, 0]
+        for i in range(self.processes):
+            pid, probes, hits, stores = _SLOT.unpack_from(
+                self._shm.buf, self._slots + i * _SLOT.size)
+            if not pid:
+                continue
+            rows.append(_stats_row(f"Process: {pid}", probes, hits, stores))
+            total = [total[0] + probes, total[1] + hits, total[2] + stores]
+        rows.append(_stats_row("Global", *total))
+        return utils.justify_table(rows)
+
+    def close(self) -> None:
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def __enter__(self) -> 'SharedTable':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def attach(name: str, lock: Any) -> None:
+    """Attaches the current process to the table."""
+
+    global table
+    table = SharedTable.attach(name, lock)
+
+
+def shared(func: Callable) -> Callable:
+    """Probes the table the process is attached to before calling the search
+    function, and stores its result afterwards. The function must take the
+    game and the depth. Calls with any further argument set bypass the table,
+    which keys values by the game and the depth only."""
+
+    @functools.wraps(func)
+    def inner(game_, depth: int = -1, **kwargs):
+        if table is None or any(kwargs.values()):
+            return func(game_, depth=depth, **kwargs)
+
+        rv = table.probe(game_, depth)
+        if rv is None:
+            rv = func(game_, depth=depth)
+            table.store(game_, depth, rv)
+        return rv
+
+    return inner
+
+
+def _check(zobrist: int, depth: int, value: float) -> int:
+    bits, = struct.unpack('<Q', struct.pack('<d', value))
+    return zobrist ^ (depth & _MASK) ^ bits
+
+
+def _stats_row(name: str, probes: int, hits: int, stores: int) -> List[str]:
+    return [name,
+            f"Hit: {hits / (probes or 0.001) * 100:.2f}%",
+            f"Probes: {probes}",
+            f"Stores: {stores}"]
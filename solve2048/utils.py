@@ -1,4 +1,7 @@
-from typing import List
+import random
+import signal
+import sys
+from typing import Any, List, Tuple
 
 
 def justify_table(table: List[List[str]]) -> str:
@@ -18,3 +21,39 @@ def justify_table(table: List[List[str]]) -> str:
             rv += col.ljust(maxlens[i], " ") + "\t"
         rv += "\n"
     return rv
+
+
+def setup_process(seed: int, cache_size: int = None) -> None:
+    """Sets up the random seed, recursion limit and cache size of the current
+    process. Must be called before the searching modules are imported.
+
+    :param seed: Random seed.
+    :param cache_size: Cache size. (Actual cache size is 2 ** cache_size)
+    """
+
+    import cache
+
+    random.seed(seed)
+    sys.setrecursionlimit(1500)
+
+    if cache_size:
+        cache.CACHE_MAXSIZE = 2 ** cache_size
+
+
+def init_worker(seed: int,
+                cache_size: int = None,
+                table: Tuple[str, Any] = None) -> None:
+    """Sets up a worker process of a process pool. See `setup_process`.
+
+    :param table: Name and lock of the shared transposition table to attach
+        to.
+    """
+
+    # Ctrl+C is delivered to the whole process group; let the parent shut
+    # the workers down instead.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_process(seed, cache_size)
+
+    if table is not None:
+        import transposition
+        transposition.attach(*table)
@@ -0,0 +1,85 @@
+import io
+
+import pytest
+
+import analysis
+import rules
+
+ROWS = [[2, 0, 4], [0, 8, 0], [2, 2, 0]]
+
+
+@pytest.mark.parametrize('size', [(3, 3), (2, 3)])
+def test_symmetries_map_directions(size):
+    height, width = size
+    rows = ROWS[:height]
+    game_ = rules.Game2048.from_rows(rows, terminal_score=64)
+
+    for f, mapping in analysis.symmetries(size):
+        transformed = rules.Game2048.from_rows(f(rows), terminal_score=64)
+        for d in rules.Direction:
+            action = dict(player=+1, direction=d)
+            mapped = dict(player=+1, direction=mapping[d])
+            assert game_.can_invoke(**action) == \
+                transformed.can_invoke(**mapped)
+            if game_.can_invoke(**action):
+                assert f(game_.invoke(**action).to_rows()) == \
+                    transformed.invoke(**mapped).to_rows()
+
+
+def test_symmetries_count():
+    assert len(analysis.symmetries((3, 3))) == 8
+    assert len(analysis.symmetries((2, 3))) == 4
+
+
+def test_read_jsonl():
+    f = io.StringIO('[[2, 0]]\n\n{"board": [[0, 4]]}\nnope\n')
+
+    rv = list(analysis.read_jsonl(f))
+
+    assert rv[:2] == [[[2, 0]], [[0, 4]]]
+    assert isinstance(rv[2], ValueError)
+
+
+def test_read_csv():
+    f = io.StringIO('2,,0,4\n2,0\nx,0,0,0\n')
+
+    rv = list(analysis.read_csv(f, (2, 2)))
+
+    assert rv[0] == [[2, 0], [0, 4]]
+    assert isinstance(rv[1], ValueError)
+    assert isinstance(rv[2], ValueError)
+
+
+def test_analyze_stream():
+    boards = [ROWS, ValueError('bad'), ROWS, [[3]]]
+
+    rv = list(analysis.analyze_stream(boards,
+                                      size=(3, 3),
+                                      depth=1,
+                                      score=64,
+                                      workers=1,
+                                      batch_size=3))
+
+    assert [r['index'] for r in rv] == [0, 1, 2, 3]
+    assert 'error' in rv[1] and 'error' in rv[3]
+    assert rv[0] == dict(board=ROWS,
+                         index=0,
+                         **analysis.analyze_board(ROWS, 1, 64))
+    assert rv[2] == dict(rv[0], index=2)
+
+
+def test_analyze_stream_symmetric():
+    rotated = [list(x) for x in zip(*ROWS)][::-1]
+
+    rv = list(analysis.analyze_stream([ROWS, rotated],
+                                      size=(3, 3),
+                                      depth=1,
+                                      score=64,
+                                      workers=1,
+                                      symmetric=True))
+
+    assert rv[1]['board'] == rotated
+    assert sorted(rv[0]['utilities'].values()) == \
+        sorted(rv[1]['utilities'].values())
+    assert rv[0]['utilities'][rv[0]['direction']] == \
+        rv[1]['utilities'][rv[1]['direction']]
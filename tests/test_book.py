@@ -0,0 +1,74 @@
+import pytest
+
+import book
+import rules
+import search
+
+
+@pytest.fixture(scope='module')
+def path(tmp_path_factory):
+    rv = str(tmp_path_factory.mktemp('book') / 'book')
+    book.build(rv, (3, 3), 64,
+               depth=1,
+               games=4,
+               moves=10,
+               positions=50,
+               book_depth=2,
+               workers=1)
+    return rv
+
+
+def _positions():
+    """:returns: Positions of the self-play games the book was built from."""
+
+    rv = []
+    for seed in range(4):
+        for rows in book._self_play(seed, (3, 3), 64, 1, 10):
+            rv.append(rules.Game2048.from_rows([list(r) for r in rows],
+                                               terminal_score=64))
+    return rv
+
+
+def test_lookup(path):
+    with book.Book(path) as book_:
+        assert book_.size == (3, 3)
+        assert book_.terminal_score == 64
+        assert book_.depth == 2
+        assert 0 < book_.count <= 50
+
+        hits = [g for g in _positions() if book_.lookup(g)]
+        assert hits
+        for game_ in hits:
+            direction = book_.lookup(game_)
+            assert any(a['direction'] == direction for a in game_.actions())
+
+
+def test_lookup_matches_search(path):
+    with book.Book(path) as book_:
+        hits = [g for g in _positions() if book_.lookup(g)]
+        assert hits
+        for game_ in hits:
+            action = search.expectimax_decision(game_,
+                                                depth=book_.depth,
+                                                alpha=game_.min_utility(),
+                                                beta=game_.max_utility())
+            assert book_.lookup(game_) == action['direction']
+
+
+def test_lookup_miss(path):
+    with book.Book(path) as book_:
+        game_ = rules.Game2048.from_rows(
+            [[2, 4, 8], [16, 32, 2], [4, 8, 0]], terminal_score=64)
+        assert book_.lookup(game_) is None
+
+        with pytest.raises(ValueError, match='does not match'):
+            book_.lookup(rules.Game2048.from_rows([[2, 0], [0, 0]],
+                                                  terminal_score=64))
+
+
+def test_truncated(path, tmp_path):
+    truncated = tmp_path / 'truncated'
+    truncated.write_bytes(open(path, 'rb').read()[:-1])
+
+    with pytest.raises(ValueError, match='Truncated'):
+        book.Book(str(truncated))
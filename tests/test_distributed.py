@@ -0,0 +1,78 @@
+import asyncio
+import json
+import multiprocessing
+import socket
+import threading
+import time
+
+import distributed
+
+
+def _start(coordinator):
+    rv = {}
+    thread = threading.Thread(
+        target=lambda: rv.update(
+            asyncio.run(coordinator.run('127.0.0.1', 0))))
+    thread.start()
+    while coordinator.port is None:
+        time.sleep(0.01)
+    return thread, rv
+
+
+def _coordinator(games):
+    return distributed.Coordinator(games=games,
+                                   size=(2, 3),
+                                   score=32,
+                                   depth=1,
+                                   seed=7,
+                                   timeout=10.)
+
+
+def test_play_game_deterministic():
+    a = distributed.play_game(seed=3, size=(2, 3), score=32, depth=1)
+    b = distributed.play_game(seed=3, size=(2, 3), score=32, depth=1)
+
+    assert (a['won'], a['score'], a['moves']) == \
+        (b['won'], b['score'], b['moves'])
+
+
+def test_coordinate_workers():
+    coordinator = _coordinator(games=6)
+    thread, stats = _start(coordinator)
+
+    workers = [multiprocessing.Process(target=distributed.work,
+                                       args=('127.0.0.1', coordinator.port))
+               for _ in range(3)]
+    for w in workers:
+        w.start()
+    thread.join(timeout=60)
+    for w in workers:
+        w.join(timeout=10)
+
+    assert sorted(coordinator.results) == list(range(7, 13))
+    assert stats['games'] == 6
+    assert stats['reassigned'] == 0
+    assert all(w.exitcode == 0 for w in workers)
+
+    expected = distributed.play_game(seed=9, size=(2, 3), score=32, depth=1)
+    assert coordinator.results[9]['moves'] == expected['moves']
+
+
+def test_coordinate_reassign():
+    coordinator = _coordinator(games=2)
+    thread, stats = _start(coordinator)
+
+    # Takes a job and dies without answering.
+    with socket.create_connection(('127.0.0.1', coordinator.port)) as s:
+        f = s.makefile('rwb')
+        f.write(json.dumps(dict(type='hello', name='dead')).encode() + b'\n')
+        f.flush()
+        job = json.loads(f.readline())
+    assert job['type'] == 'job'
+
+    distributed.work('127.0.0.1', coordinator.port)
+    thread.join(timeout=60)
+
+    assert sorted(coordinator.results) == [7, 8]
+    assert stats['reassigned'] == 1
+    assert coordinator.results[job['seed']]['worker'] != 'dead'
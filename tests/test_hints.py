@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+import cache
+import hints
+import rules
+import search
+
+
+def _game():
+    return rules.Game2048.from_rows(
+        [[2, 0, 0, 4], [0, 2, 0, 0], [0, 0, 8, 0], [2, 0, 0, 0]],
+        terminal_score=2048)
+
+
+def test_best_direction():
+    # Symmetric boards tie, and are decided by deepening.
+    boards = [[[2, 0, 0], [0, 4, 0], [0, 0, 2]],
+              [[2, 0, 2], [0, 0, 0], [2, 0, 2]],
+              [[4, 2, 0], [2, 0, 0], [0, 0, 0]]]
+    for rows in boards:
+        game_ = rules.Game2048.from_rows(rows, terminal_score=64)
+        cache.clear(module='search')
+        expected = search.expectimax_decision(game_,
+                                              depth=2,
+                                              alpha=game_.min_utility(),
+                                              beta=game_.max_utility())
+        cache.clear(module='search')
+
+        assert hints.best_direction(game_, depth=2) == expected['direction']
+
+
+def test_best_direction_cancelled():
+    cache.clear(module='search')
+
+    with pytest.raises(search.SearchCancelled):
+        hints.best_direction(_game(), depth=2, cancelled=lambda: True)
+    # Not cached as if it was finished.
+    assert hints.best_direction(_game(), depth=2) is not None
+
+
+def test_best_direction_no_moves():
+    game_ = rules.Game2048.from_rows([[2, 4], [4, 2]], terminal_score=64)
+
+    assert hints.best_direction(game_, depth=2) is None
+
+
+def test_cancelled():
+    cache.clear(module='search')
+
+    with pytest.raises(search.SearchCancelled):
+        search.expectimax_value(_game().invoke(direction=rules.Direction.UP,
+                                               player=+1),
+                                depth=3,
+                                cancelled=lambda: True)
+
+
+def test_hint_search():
+    received = []
+    done = threading.Event()
+
+    def on_hint(game_, direction):
+        received.append((game_, direction))
+        done.set()
+
+    game_ = rules.Game2048.from_rows(
+        [[2, 0, 0], [0, 4, 0], [0, 0, 2]], terminal_score=64)
+    hint_search = hints.HintSearch(2, on_hint)
+    hint_search.start(game_)
+
+    assert done.wait(timeout=30)
+    hint_search.cancel()
+    assert received == [(game_, hints.best_direction(game_, depth=2))]
+
+
+def test_hint_search_abandoned():
+    received = []
+    cache.clear(module='search')
+    max_cache = cache.get_cache('search', '_expectimax_max_value')
+
+    hint_search = hints.HintSearch(12, lambda *args: received.append(args))
+    hint_search.start(_game())
+    time.sleep(0.2)
+
+    start = time.perf_counter()
+    hint_search.cancel()
+
+    assert time.perf_counter() - start < 1
+    assert not received
+    # Values of the abandoned search are kept for the following ones.
+    assert len(max_cache) > 0
@@ -0,0 +1,72 @@
+import json
+import os
+import subprocess
+import sys
+
+import book
+import retrograde
+
+MAIN = os.path.join(os.path.dirname(__file__), '..', 'solve2048', 'main.py')
+
+
+def _solve(*args, check=True):
+    return subprocess.run(
+        [sys.executable, MAIN, 'solve', '-hh', '3', '-ww', '3',
+         '--depth', '1', '--score', '64', *args],
+        capture_output=True, text=True, check=check)
+
+
+def test_headless_move():
+    rv = _solve('--headless', 'move')
+
+    records = [json.loads(line) for line in rv.stdout.splitlines()]
+    assert [r['move'] for r in records] == list(range(1, len(records) + 1))
+    assert 'Moves/s' in rv.stderr
+
+    # Same game as without headless mode.
+    directions = [line for line in _solve().stdout.splitlines()
+                  if line in ('UP', 'RIGHT', 'DOWN', 'LEFT')]
+    assert [r['direction'] for r in records] == directions
+
+
+def test_headless_game(tmp_path):
+    path = tmp_path / 'games.jsonl'
+
+    rv = _solve('--headless', 'game', '--output', str(path))
+
+    assert rv.stdout == ''
+    record, = [json.loads(line) for line in path.read_text().splitlines()]
+    assert record['seed'] == 0
+    assert record['moves'] > 0
+    assert record['won'] == (record['score'] >= 64)
+
+
+def test_table_mismatch(tmp_path):
+    path = str(tmp_path / 'table')
+    retrograde.build(path, (2, 3), 32)
+
+    rv = _solve('--table', path, check=False)
+
+    assert rv.returncode == 2
+    assert 'is for 2x3 boards and --score 32' in rv.stderr
+    assert 'Traceback' not in rv.stderr
+
+
+def test_book_mismatch(tmp_path):
+    path = str(tmp_path / 'book')
+    book.build(path, (2, 3), 32,
+               depth=1, games=1, moves=5, positions=10, book_depth=1,
+               workers=1)
+
+    rv = _solve('--book', path, check=False)
+
+    assert rv.returncode == 2
+    assert 'is for 2x3 boards and --score 32' in rv.stderr
+    assert 'Traceback' not in rv.stderr
+
+
+def test_node_budget_max_memory():
+    rv = _solve('--node-budget', '1000', '--max-memory', '100', check=False)
+
+    assert rv.returncode == 2
+    assert '--node-budget does not support --max-memory' in rv.stderr
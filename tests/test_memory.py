@@ -0,0 +1,101 @@
+import cache
+import memory
+import rules
+import search
+
+
+def _fill():
+    cache.clear()
+    game_ = rules.Game2048.from_rows(
+        [[2, 0, 0], [0, 4, 0], [0, 0, 2]], terminal_score=64)
+    search.expectimax_analysis(game_, depth=3)
+    for a in game_.all_actions():
+        game_.can_invoke(**a)
+
+
+def _len(module, name):
+    return len(cache.get_cache(module, name))
+
+
+def test_rss():
+    assert memory.rss() > 0
+
+
+def test_under_threshold():
+    _fill()
+    governor = memory.MemoryGovernor(100, rss_=lambda: 80)
+
+    assert governor.check() == 0
+    assert governor.interventions == 0
+    assert _len('rules', 'can_invoke') > 0
+
+
+def test_cheap_caches_first():
+    _fill()
+    searches = _len('search', '_expectimax_max_value')
+    governor = memory.MemoryGovernor(100, rss_=lambda: 92)
+
+    # Over by a few bytes, so that the first step is enough.
+    assert governor.check() > 0
+    assert governor.interventions == 1
+    assert _len('rules', 'can_invoke') == 0
+    assert _len('rules', 'actions') > 0
+    assert _len('search', '_expectimax_max_value') == searches
+
+
+def test_shallow_depths_next():
+    _fill()
+    limit = 10 ** 9
+    cheap = sum(cache.get_cache('rules', name).estimate_bytes()
+                for name in ['can_invoke', 'actions'])
+    used = int(0.75 * limit) + cheap + 1
+    governor = memory.MemoryGovernor(limit, threshold=0.5, rss_=lambda: used)
+
+    def keys():
+        return {(c.name, k) for c in cache.iter_caches(module='search')
+                for k in c}
+
+    before = keys()
+    shallowest = min(d for d in (memory._depth(k) for _, k in before)
+                     if d is not None)
+    governor.check()
+    dropped = before - keys()
+
+    assert _len('rules', 'can_invoke') == 0
+    assert _len('rules', 'actions') == 0
+    assert dropped
+    assert {memory._depth(k) for _, k in dropped} == {shallowest}
+
+
+def test_freed_memory_reusable():
+    _fill()
+    governor = memory.MemoryGovernor(100, rss_=lambda: 95)
+
+    assert governor.check() > 0
+    interventions = governor.interventions
+
+    # Resident set size did not drop, but the freed memory was not reused.
+    assert governor.check() == 0
+    assert governor.interventions == interventions
+
+
+def test_drop():
+    c = cache.StatisticsCache(8)
+    for i in range(6):
+        c[i] = str(i)
+
+    assert c.drop(lambda k: k % 2) == 3
+    assert sorted(c) == [0, 2, 4]
+
+
+def test_estimate_bytes():
+    c = cache.StatisticsCache(64)
+    assert c.estimate_bytes() == 0
+
+    for i in range(32):
+        c[i] = (i, i)
+    size = c.estimate_bytes()
+    for i in range(32, 64):
+        c[i] = (i, i)
+
+    assert 0 < size < c.estimate_bytes()
@@ -0,0 +1,103 @@
+import math
+
+import pytest
+
+import record
+import rules
+
+
+def _game(rows, score=64):
+    return rules.Game2048.from_rows(rows, terminal_score=score)
+
+
+def test_header_roundtrip():
+    header = record.Header((3, 4), 7, 2048, {'depth': 5}, True)
+
+    rv, offset = record.unpack_header(record.pack_header(header))
+
+    assert rv == header
+    assert offset == len(record.pack_header(header))
+
+
+def test_board_roundtrip():
+    game_ = _game([[2, 0, 1024], [0, 4, 0]])
+
+    data = record.pack_board(game_.state, game_.size)
+
+    assert data == bytes([1, 0, 10, 0, 2, 0])
+    assert record.unpack_board(data, game_.size) == game_.state
+
+
+def test_read_records(tmp_path):
+    path = str(tmp_path / 'game.rec')
+    first = _game([[2, 0], [0, 2]])
+    second = _game([[4, 0], [0, 2]])
+
+    with record.RecordWriter(path, (2, 2), 3, 64, {}, utilities=True) as w:
+        w.write(first,
+                direction=rules.Direction.UP,
+                spawn=(1, 0),
+                utilities={rules.Direction.UP: 1.5,
+                           rules.Direction.LEFT: -2.0})
+        w.write(second)
+
+    rv = list(record.read_records(path))
+
+    assert len(rv) == 2
+    assert rv[0].direction == rules.Direction.UP
+    assert rv[0].spawn == (1, 0)
+    assert rv[0].utilities == {rules.Direction.UP: 1.5,
+                               rules.Direction.LEFT: -2.0}
+    assert rv[0].to_game().state == first.state
+    assert rv[0].to_game().terminal_score == 64
+    assert rv[1].direction is None
+    assert rv[1].spawn is None
+    assert rv[1].utilities == {}
+    assert record.read_header(path) == rv[0].header
+
+
+def test_read_records_nan_utilities(tmp_path):
+    path = str(tmp_path / 'game.rec')
+
+    with record.RecordWriter(path, (2, 2), 0, 64, {}, utilities=True) as w:
+        w.write(_game([[2, 0], [0, 0]]),
+                direction=rules.Direction.RIGHT,
+                utilities={rules.Direction.RIGHT: math.nan})
+
+    rv, = record.read_records(path)
+
+    assert rv.utilities == {}
+
+
+def test_read_records_without_utilities(tmp_path):
+    path = str(tmp_path / 'game.rec')
+
+    with record.RecordWriter(path, (2, 2), 0, 64, {}) as w:
+        w.write(_game([[2, 0], [0, 0]]), direction=rules.Direction.DOWN)
+
+    rv, = record.read_records(path)
+
+    assert rv.direction == rules.Direction.DOWN
+    assert rv.utilities is None
+
+
+def test_read_records_truncated(tmp_path):
+    path = tmp_path / 'game.rec'
+
+    with record.RecordWriter(str(path), (2, 2), 0, 64, {}) as w:
+        w.write(_game([[2, 0], [0, 0]]))
+    path.write_bytes(path.read_bytes()[:-1])
+
+    with pytest.raises(ValueError, match='Truncated'):
+        list(record.read_records(str(path)))
+
+
+@pytest.mark.parametrize('data', [b'', b'garbage', record.MAGIC + b'\x01'])
+def test_read_records_invalid(tmp_path, data):
+    path = tmp_path / 'game.rec'
+    path.write_bytes(data)
+
+    with pytest.raises(ValueError):
+        list(record.read_records(str(path)))
+    with pytest.raises(ValueError):
+        record.read_header(str(path))
@@ -0,0 +1,66 @@
+import pytest
+
+import retrograde
+import rules
+
+
+@pytest.fixture(scope='module')
+def table(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('retrograde') / 'table')
+    retrograde.build(path, (2, 3), 32)
+    with retrograde.Table(path) as rv:
+        yield rv
+
+
+def test_moves_match_rules(table):
+    moves = retrograde._Moves((2, 3), 5)
+    for state, _, _ in table:
+        game_ = retrograde.to_game(state, (2, 3), 32)
+        expected = {a['direction']: retrograde.tiles(game_.invoke(**a))
+                    for a in game_.actions()}
+        assert dict(moves.apply(state)) == expected
+
+
+def test_lookup(table):
+    assert table.size == (2, 3)
+    assert table.terminal_score == 32
+    for state, direction, p in table:
+        game_ = retrograde.to_game(state, (2, 3), 32)
+        assert table.lookup(game_) == (direction, p)
+        assert 0 <= p <= 1
+
+
+def test_probabilities_are_optimal(table):
+    moves = retrograde._Moves((2, 3), 5)
+    for state, direction, p in table:
+        expected = {}
+        for d, moved in moves.apply(state):
+            children = list(retrograde._spawns(moved))
+            expected[d] = sum(table.probability(c)
+                              for c in children) / len(children)
+        assert p == max(expected.values())
+        assert expected[direction] == p
+
+
+def test_lookup_size_mismatch(table):
+    game_ = rules.Game2048.from_rows([[2, 0], [0, 0]], terminal_score=32)
+
+    with pytest.raises(ValueError):
+        table.lookup(game_)
+
+
+def test_build_too_large(tmp_path):
+    assert retrograde.state_bound((3, 3), 64) <= retrograde.MAX_STATES
+    assert retrograde.state_bound((3, 3), 512) > retrograde.MAX_STATES
+
+    with pytest.raises(ValueError):
+        retrograde.build(str(tmp_path / 'table'), (3, 3), 512)
+
+
+def test_check(table):
+    checked, optimal, loss = retrograde.check(
+        table, lambda g: table.lookup(g)[0], states=50)
+
+    assert checked >= 50
+    assert optimal == checked
+    assert loss == 0
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+import rules
+
+
+def _play(size, moves=200):
+    random.seed(1)
+    game_ = rules.Game2048.initialize(size=size, terminal_score=2 ** 20)
+    for _ in range(moves):
+        actions = game_.actions()
+        if not actions:
+            break
+        game_ = game_.invoke(**random.choice(actions))
+        yield game_
+
+
+def test_zobrist_incremental():
+    for game_ in _play((4, 4)):
+        fresh = rules.Game2048(dict(game_.state),
+                               player=game_.player,
+                               size=game_.size,
+                               terminal_score=game_.terminal_score)
+        assert game_.zobrist == fresh.zobrist
+        assert hash(game_) == hash(fresh)
+        assert game_ == fresh
+
+
+def test_zobrist_player():
+    game_ = rules.Game2048.from_rows([[2, 0], [0, 0]], terminal_score=64)
+    other = rules.Game2048.from_rows([[2, 0], [0, 0]], terminal_score=64,
+                                     player=-1)
+
+    assert game_.zobrist != other.zobrist
+    assert game_ != other
+
+
+def test_eq_verifies_state():
+    game_ = rules.Game2048.from_rows([[2, 0], [0, 0]], terminal_score=64)
+    other = rules.Game2048.from_rows([[0, 2], [0, 0]], terminal_score=64)
+    # Forge a collision of the hashes.
+    other.zobrist = game_.zobrist
+
+    assert hash(game_) == hash(other)
+    assert game_ != other
+    assert len({game_: 1, other: 2}) == 2
+
+
+def test_estimate_terminal():
+    won = rules.Game2048.from_rows([[64, 0], [0, 2]], terminal_score=64)
+    lost = rules.Game2048.from_rows([[2, 4], [4, 2]], terminal_score=64)
+    full = rules.Game2048.from_rows([[2, 2], [4, 8]], terminal_score=64,
+                                    player=-1)
+
+    for game_ in (won, lost, full):
+        assert game_.estimate() == game_.utility()
+
+
+def test_estimate_matches_utility():
+    for size in ((2, 3), (3, 3), (3, 4), (4, 4)):
+        for game_ in _play(size):
+            assert game_.estimate() == pytest.approx(game_.utility())
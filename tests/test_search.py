@@ -0,0 +1,223 @@
+import random
+import sys
+
+import pytest
+
+import cache
+import rules
+import search
+
+
+def _games():
+    random.seed(0)
+    game_ = rules.Game2048.initialize(size=(3, 3), terminal_score=64)
+    rv = []
+    for _ in range(20):
+        actions = game_.actions()
+        if not actions:
+            break
+        game_ = game_.invoke(**random.choice(actions))
+        rv.append(game_)
+    return rv
+
+
+@pytest.mark.parametrize('depth', [0, 1, 2, 3])
+def test_expectimax_value(depth):
+    for game_ in _games():
+        if game_.player == +1:
+            f = search._expectimax_max_value
+        else:
+            f = search._expectimax_chance_value
+
+        cache.clear(module='search')
+        expected = f(game_, depth=depth)
+        cache.clear(module='search')
+        assert search.expectimax_value(game_, depth=depth) == expected
+        # .. and again from the warm caches
+        assert search.expectimax_value(game_, depth=depth) == expected
+
+
+def test_expectimax_value_without_recursion():
+    game_ = next(g for g in _games() if g.player == +1)
+    cache.clear(module='search')
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(100)
+    try:
+        search.expectimax_value(game_, depth=4)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def test_expectimax_decision_iterative():
+    for game_ in _games():
+        if game_.player != +1 or not game_.actions():
+            continue
+        cache.clear()
+        expected = search.expectimax_analysis(game_, depth=2)
+        cache.clear()
+        assert search.expectimax_analysis(game_, depth=2,
+                                          iterative=True) == expected
+
+
+def test_sampled_expectimax_exact():
+    for game_ in _games():
+        if game_.player != +1 or not game_.actions():
+            continue
+        expected = [
+            (a, search._expectimax_chance_value(game_.invoke(**a), depth=2))
+            for a in game_.actions()]
+
+        _, rv = search.sampled_expectimax_analysis(game_, 2, (0,))
+
+        assert [(a, v) for a, v, _ in rv] == pytest.approx(expected)
+        assert all(e == 0 for _, _, e in rv)
+
+
+def test_sampled_expectimax_deterministic():
+    game_ = rules.Game2048.from_rows(
+        [[2, 0, 0, 0], [0, 0, 4, 0], [0, 0, 0, 0], [0, 2, 0, 0]],
+        terminal_score=64)
+
+    cache.clear(module='search')
+    rv = search.sampled_expectimax_analysis(game_, 3, (3, 2), seed=1)
+    cache.clear(module='search')
+
+    assert search.sampled_expectimax_analysis(game_, 3, (3, 2),
+                                              seed=1) == rv
+    assert any(e > 0 for _, _, e in rv[1])
+
+
+@pytest.mark.parametrize('depth', [0, 1, 2, 3])
+def test_layered_expectimax_values(depth):
+    games = _games()
+    for player in (+1, -1):
+        roots = [g for g in games if g.player == player]
+        expected = [search.expectimax_value(g, depth=depth) for g in roots]
+
+        rv, stats = search.layered_expectimax_values(roots, depth=depth)
+
+        assert rv == expected
+        assert len(stats) == depth + 1
+        assert stats[-1].unique == stats[-1].leaves
+        assert all(s.generated >= s.unique for s in stats)
+
+
+def test_layered_expectimax_dedup():
+    game_ = rules.Game2048.from_rows(
+        [[2, 0, 0], [0, 0, 0], [0, 0, 4]], terminal_score=64)
+
+    _, stats = search.layered_expectimax_values([game_], depth=3)
+
+    # Different moves followed by different spawns reach the same boards.
+    assert stats[2].dedup_ratio() > 1
+
+
+def test_expectimax_decision_layered():
+    for game_ in _games():
+        if game_.player != +1 or not game_.actions():
+            continue
+        cache.clear()
+        expected = search.expectimax_analysis(game_, depth=2)
+        cache.clear()
+        assert search.expectimax_analysis(game_, depth=2,
+                                          layered=True) == expected
+
+
+@pytest.mark.parametrize('depth', [1, 2, 3])
+def test_cheap_value(depth):
+    for game_ in _games():
+        f = (search._expectimax_max_value if game_.player == +1
+             else search._expectimax_chance_value)
+
+        cache.clear(module='search')
+        full = f(game_, depth=depth)
+        cheap = f(game_, depth=depth, cheap=True)
+
+        # Cheap values are cached apart from the full ones.
+        assert f(game_, depth=depth) == full
+        assert search.expectimax_value(game_, depth=depth,
+                                       cheap=True) == cheap
+        cache.clear(module='search')
+        assert search.expectimax_value(game_, depth=depth,
+                                       cheap=True) == cheap
+        assert search.layered_expectimax_values(
+            [game_], depth=depth, cheap=True)[0] == [cheap]
+
+
+def test_full_depth():
+    for game_ in _games():
+        if game_.player != +1 or not game_.actions():
+            continue
+        cache.clear()
+        expected = search.expectimax_analysis(game_, depth=2)
+        cache.clear()
+        # Ties deepen the search up to depth 4.
+        assert search.expectimax_analysis(game_, depth=2,
+                                          full_depth=4) == expected
+
+
+def test_benchmark_evaluation():
+    games = [g for g in _games() if g.player == +1 and g.actions()]
+
+    rv = search.benchmark_evaluation(games, depth=2, full_depth=1)
+
+    assert rv['positions'] == len(games)
+    assert rv['full_seconds_per_decision'] > 0
+    assert rv['tiered_seconds_per_decision'] > 0
+    assert rv['full_nodes_per_second'] > 0
+    assert rv['tiered_nodes_per_second'] > 0
+    assert rv['agreement'] == 1
+
+
+def test_estimate_nodes():
+    game_ = rules.Game2048.from_rows(
+        [[2, 0, 0], [0, 4, 0], [0, 0, 0]], terminal_score=64)
+    moves = len(game_.actions())
+
+    assert search.estimate_nodes(game_, 0) == moves
+    assert search.estimate_nodes(game_, 1) == moves + moves * 7
+    assert search.estimate_nodes(game_, 2) == moves + moves * 7 * (1 + moves)
+
+
+def test_budget_depth():
+    game_ = rules.Game2048.from_rows(
+        [[2, 0, 0], [0, 4, 0], [0, 0, 0]], terminal_score=64)
+
+    assert search.budget_depth(game_, 0, 5) == 0
+    assert search.budget_depth(game_, 10 ** 9, 5) == 5
+    budget = search.estimate_nodes(game_, 3)
+    assert search.budget_depth(game_, budget, 5) == 3
+    assert search.budget_depth(game_, budget - 1, 5) == 2
+
+
+def test_budgeted_expectimax_analysis():
+    game_ = rules.Game2048.from_rows(
+        [[2, 0, 0], [0, 4, 0], [0, 0, 2]], terminal_score=64)
+    cache.clear(module='search')
+
+    action, utilities, depth, aborted = \
+        search.budgeted_expectimax_analysis(game_, 10 ** 6, 3)
+
+    assert (depth, aborted) == (3, 0)
+    assert utilities == [
+        (a, search._expectimax_chance_value(game_.invoke(**a), depth=3))
+        for a in game_.actions()]
+    assert action in [a for a, v in utilities
+                      if v == max(v for _, v in utilities)]
+
+
+def test_budgeted_expectimax_analysis_abandoned():
+    # Merges free more tiles than the estimate assumes.
+    game_ = rules.Game2048.from_rows(
+        [[2, 2, 4], [4, 8, 8], [2, 2, 0]], terminal_score=64)
+    budget = search.estimate_nodes(game_, 3)
+
+    rv = []
+    for _ in range(2):
+        cache.clear(module='search')
+        rv.append(search.budgeted_expectimax_analysis(game_, budget, 3))
+
+    _, _, depth, aborted = rv[0]
+    assert depth < 3
+    assert aborted == 3 - depth
+    assert rv[0] == rv[1]
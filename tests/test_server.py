@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+import pytest
+
+import rules
+import server
+
+
+@pytest.fixture(scope='module')
+def server_():
+    rv = server.SolverServer(workers=1, size=(2, 2), depth=1, score=64)
+    yield rv
+    rv.close()
+
+
+def _request(server_, request):
+    line = json.dumps(request).encode('utf-8')
+    return asyncio.run(server_.request(line))
+
+
+def test_request(server_):
+    rv = _request(server_, {'board': [[2, 0], [0, 2]]})
+
+    assert rv['direction'] in [d.name for d in rules.Direction]
+    assert set(rv['utilities']) <= {d.name for d in rules.Direction}
+    assert rv['latency'] > 0
+
+
+def test_request_no_moves(server_):
+    rv = _request(server_, {'board': [[2, 4], [4, 2]]})
+
+    assert rv['direction'] is None
+
+
+@pytest.mark.parametrize('request_', [
+    {'board': [1, 2]},
+    {'board': []},
+    {'board': [[2, 0], [0]]},
+    {'board': [[2, 0, 0], [0, 2, 0]]},
+    {'board': [[2.7, 0], [0, 2]]},
+    {'board': [[True, 0], [0, 2]]},
+    {'board': [['2', 0], [0, 2]]},
+    {'board': [[3, 0], [0, 2]]},
+    {'board': [[2, 0], [0, 2]], 'depth': 'deep'},
+    {'depth': 1},
+    [1, 2],
+])
+def test_request_invalid(server_, request_):
+    failed = server_.failed
+
+    rv = _request(server_, request_)
+
+    assert 'error' in rv
+    assert server_.failed == failed + 1
+
+
+def test_request_malformed_json(server_):
+    rv = asyncio.run(server_.request(b'{"board": '))
+
+    assert 'error' in rv
+
+
+def test_stats(server_):
+    _request(server_, {'board': [[2, 0], [0, 0]]})
+
+    rv = _request(server_, {'stats': True})
+
+    assert rv['served'] >= 1
+    assert rv['pending'] == 0
+    assert rv['queue_depth'] == 0
+    assert rv['latency_max'] >= rv['latency_p50'] > 0
+
+
+def test_from_rows_too_large():
+    with pytest.raises(ValueError, match='at most'):
+        rules.Game2048.from_rows([[0] * 50] * 50, terminal_score=64)
@@ -0,0 +1,92 @@
+import concurrent.futures
+
+import pytest
+
+import rules
+import transposition
+import utils
+
+ROWS = [[2, 0, 4], [0, 8, 0], [2, 2, 0]]
+
+
+@pytest.fixture
+def table():
+    with transposition.SharedTable((3, 3), 64, 16, 2) as rv:
+        yield rv
+
+
+def _game(rows=ROWS, score=64):
+    return rules.Game2048.from_rows(rows, terminal_score=score)
+
+
+def test_probe_store(table):
+    game_ = _game()
+
+    assert table.probe(game_, 3) is None
+    table.store(game_, 3, 1.5)
+
+    assert table.probe(game_, 3) == 1.5
+    assert table.probe(game_, 2) is None
+    assert table.probe(_game(score=128), 3) is None
+    assert (table.probes, table.hits, table.stores) == (4, 1, 1)
+
+
+def test_probe_verifies_board(table):
+    game_ = _game()
+    other = _game([[0, 2, 4], [0, 8, 0], [2, 2, 0]])
+    other.zobrist = game_.zobrist  # forge a collision
+
+    table.store(game_, 3, 1.5)
+
+    assert table.probe(other, 3) is None
+
+
+def test_probe_detects_torn_record(table):
+    game_ = _game()
+    table.store(game_, 3, 1.5)
+
+    offset, _ = table._bucket(game_.zobrist & transposition._MASK)
+    table._shm.buf[offset] ^= 0xff  # corrupt the check
+
+    assert table.probe(game_, 3) is None
+
+
+def test_replacement(table):
+    game_ = _game()
+    deeper = _game([[2, 0, 4], [0, 8, 0], [2, 4, 0]])
+    shallower = _game([[2, 0, 4], [0, 8, 0], [4, 2, 0]])
+    # Forge all the games into the same bucket.
+    deeper.zobrist = game_.zobrist + table.capacity // 2
+    shallower.zobrist = game_.zobrist + table.capacity
+
+    table.store(game_, 3, 1.)
+    table.store(deeper, 4, 2.)  # replaces the depth-preferred record
+    table.store(shallower, 1, 3.)  # replaces the always-replace record
+
+    assert table.probe(deeper, 4) == 2.
+    assert table.probe(shallower, 1) == 3.
+    assert table.probe(game_, 3) is None
+
+
+def _search(rows):
+    import search
+    import transposition
+
+    game_ = rules.Game2048.from_rows(rows, terminal_score=64)
+    rv = search._expectimax_max_value(game_, depth=2)
+    transposition.table.publish_stats()
+    return rv
+
+
+def test_shared_between_processes(table):
+    with concurrent.futures.ProcessPoolExecutor(
+            2,
+            initializer=utils.init_worker,
+            initargs=(0, None, (table.name, table.lock))) as executor:
+        first = executor.submit(_search, ROWS).result()
+        second = executor.submit(_search, ROWS).result()
+
+    assert first == second
+    stats = table.get_stats()
+    assert stats.count('Process') >= 1
+    assert 'Global' in stats